@@ -1,21 +1,95 @@
 import argparse
 import json
 import logging
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 
+from core.bundle_index import BundleIndex
 from core.filesystem import FileSystem
-from core.llm import get_last_message_content, query_llm
+from core.llm import CHAT_TOKEN_BUDGET, PROMPT_TOKEN_BUDGET, ChatSession, LLMStream
+from core.line_index import LineIndex, Snippet
+from core.llm_cache import VerdictCache
+from core.incremental_clusterer import CLUSTER_STRATEGIES
 from core.log_clusterer import LogClusterer
 from core.log_contextualizer import LogContextualizer
-from core.log_filter import LogFilter
-from core.prompt import get_prompt
+from core.log_entry import LogEntry
+from core.log_filter import LogFilter, create_preclassifier
+from core.log_selection import LogSelection
+from core.log_summarizer import LogSummarizer
+from core.metrics import MetricsRecorder, add_hook
+from core.timestamp import parse_timestamp
 
 FUZZ_THRESHOLD = 70
+# Chat command that attaches the raw log lines around a log entry to the conversation
+CONTEXT_COMMAND = "context"
+
+
+def parse_time(text: str) -> datetime:
+    """Parse a time argument such as 2024-01-01T12:00:00Z or 2024-01-01."""
+    timestamp = parse_timestamp(text)
+    if timestamp is None:
+        try:
+            timestamp = datetime.fromisoformat(text)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid ISO 8601 time: '{text}'")
+    return timestamp
+
+
+def print_stream(stream: LLMStream) -> List[Dict[str, Any]]:
+    """Print a response as it arrives and return the conversation that includes it."""
+    print("***********************************")
+    for delta in stream:
+        sys.stdout.write(delta)
+        sys.stdout.flush()
+    print()
+    return stream.messages
+
+
+def find_entry(entries: List[LogEntry], query: str) -> Optional[LogEntry]:
+    """Return the log entry with the id `query`, or the most frequent one whose message contains it."""
+    for entry in entries:
+        if entry.get_id() == query:
+            return entry
+    matches = [entry for entry in entries if query.lower() in entry.message.lower()]
+    return max(matches, key=lambda entry: len(entry.references), default=None)
+
+
+def format_snippets(entry: LogEntry, snippets: List[Snippet]) -> str:
+    """Format the raw lines around a log entry for the chat, the referenced lines are marked with >."""
+    parts = [f"Raw log lines around occurrences of log entry {entry.get_id()}: {entry.message}"]
+    for snippet in snippets:
+        parts.append(f"{snippet.file} lines {snippet.start + 1}-{snippet.start + len(snippet.lines)}:")
+        parts.extend(f"{'>' if snippet.start + i == snippet.line else ' '} {line}" for i, line in enumerate(snippet.lines))
+    return "\n".join(parts)
+
+
+def write_metrics(recorder: Optional[MetricsRecorder], path: Optional[str]) -> None:
+    if recorder and path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(recorder.get_report(), f, indent=4)
+        logging.info(f"Metrics written to {path}")
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Process log files from a specified root directory.")
     parser.add_argument("path", help="Path to the root folder containing log files or a support bundle zip")
     parser.add_argument("--verbose", action="store_true", help="Enable verbose logging")
+    parser.add_argument("--namespace", action="append", help="Namespace to analyze, can be repeated and accepts globs (default: azure-iot-operations)")
+    parser.add_argument("--include", action="append", default=[], help="Only analyze the components and containers matching this glob, e.g. broker or broker/backend, can be repeated")
+    parser.add_argument("--exclude", action="append", default=[], help="Skip the components and containers matching this glob, can be repeated")
+    parser.add_argument("--since", type=parse_time, help="Skip lines logged before this ISO 8601 time, UTC unless it has an offset")
+    parser.add_argument("--until", type=parse_time, help="Skip lines logged after this ISO 8601 time, UTC unless it has an offset")
+    parser.add_argument("--strategy", choices=list(CLUSTER_STRATEGIES), default="template", help="Log clustering strategy")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of processes used to read and cluster log files")
+    parser.add_argument("--no-index", action="store_true", help="Read and cluster every log file instead of reusing the clusters of unchanged files from the previous run")
+    parser.add_argument("--no-cache", action="store_true", help="Classify every log entry with the LLM instead of reusing cached verdicts")
+    parser.add_argument("--no-preclassify", action="store_true", help="Send every uncached log entry to the LLM instead of settling obvious ones locally")
+    parser.add_argument("--token-budget", type=int, default=PROMPT_TOKEN_BUDGET, help="Estimated tokens of a single prompt, larger inputs are split")
+    parser.add_argument("--chat-token-budget", type=int, default=CHAT_TOKEN_BUDGET, help="Estimated tokens of the chat after the summary, older questions and answers are summarized past it")
+    parser.add_argument("--max-context-entries", type=int, help="Only send this many log entries to the LLM, the entries that burst the most come first")
+    parser.add_argument("--metrics-json", help="Write timing, memory and token metrics of the analysis to this file")
+    parser.add_argument("--no-llm", action="store_true", help="Only cluster the logs and print the clusters with their context as JSON, offline and without the Azure OpenAI settings")
     args = parser.parse_args()
 
     # Set logging level
@@ -24,45 +98,82 @@ def main() -> None:
     else:
         logging.basicConfig(level=logging.INFO)
 
+    recorder = None
+    if args.metrics_json:
+        recorder = MetricsRecorder()
+        add_hook(recorder)
+
     # Get all log files from the specified root folder or zip file
     log_entries = []
     fs = FileSystem(args.path)
 
     # Cluster log entries
-    cl = LogClusterer(FUZZ_THRESHOLD)
-    log_entries = cl.cluster_files(fs, "azure-iot-operations")
+    try:
+        selection = LogSelection(args.namespace or ["azure-iot-operations"], args.include, args.exclude, args.since, args.until)
+    except ValueError as e:
+        parser.error(str(e))
+    index = None if args.no_index else BundleIndex.for_bundle(fs, FUZZ_THRESHOLD, args.strategy, time_window=selection.get_time_window())
+    cl = LogClusterer(FUZZ_THRESHOLD, args.strategy, workers=args.jobs)
+    line_index = LineIndex(fs)
+    log_entries = cl.cluster_files(fs, selection, index)
     logging.info(f"Log entries: {len(log_entries)}")
+    if index:
+        logging.info(f"Bundle index: {index.get_stats()}")
+        index.save()
+
+    # Offline mode, the openai SDK is never imported
+    if args.no_llm:
+        context_entries = LogContextualizer(args.max_context_entries).contextualize(log_entries)
+        print(json.dumps(context_entries, indent=4))
+        write_metrics(recorder, args.metrics_json)
+        return
 
     # Filter to errors
-    filter = LogFilter()
+    cache = None if args.no_cache else VerdictCache()
+    preclassifier = None if args.no_preclassify else create_preclassifier(cache)
+    filter = LogFilter(cache=cache, token_budget=args.token_budget, preclassifier=preclassifier)
     error_entries = filter.error_entries(log_entries)
     logging.info(f"Failures: {len(error_entries)}")
+    logging.info(f"Entries settled by tier: {filter.tier_counts}")
+    if cache:
+        logging.info(f"Verdict cache: {cache.get_stats()}")
 
     # Contextualize errors
-    lc = LogContextualizer()
+    lc = LogContextualizer(args.max_context_entries)
     context_entries = lc.contextualize(error_entries)
-    logging.debug(json.dumps(context_entries, indent=4))
-
-    # Query LLM for a summary of the filtered errors
-    message_json = json.dumps({"logEntries": context_entries})
-    logging.debug(json.dumps(message_json, indent=4))
 
-    summarize_prompt = get_prompt("summarize.md", message_json)
-    logging.debug(summarize_prompt)
-
-    result = query_llm(summarize_prompt)
-    msg = get_last_message_content(result)
-    logging.info(f"***********************************\n{msg}")
+    # Query LLM for a summary of the filtered errors, the request runs while the context is logged
+    summarizer = LogSummarizer(token_budget=args.token_budget)
+    stream = summarizer.summarize_stream(context_entries)
+    logging.debug(json.dumps(context_entries, indent=4))
+    session = ChatSession(print_stream(stream), args.chat_token_budget)
+    write_metrics(recorder, args.metrics_json)
 
     while True:
-        user_input = input("Enter your message (or 'exit' to quit): ")
+        user_input = input(f"Enter your message ('{CONTEXT_COMMAND} <id or text>' to attach the log lines of an entry, or 'exit' to quit): ")
         if user_input.lower() == "exit":
             break
 
-        # Query LLM with the user input
-        result = query_llm(prompt=user_input, chat=result)
-        msg = get_last_message_content(result)
-        logging.info(f"***********************************\n{msg}")
+        # Attach the raw lines of a log entry, they are sent with the next message
+        command, _, query = user_input.strip().partition(" ")
+        if command.lower() == CONTEXT_COMMAND and query:
+            entry = find_entry(log_entries, query.strip())
+            if entry is None:
+                print(f"No log entry matches '{query.strip()}'")
+                continue
+            snippets = format_snippets(entry, line_index.get_entry_context(entry))
+            print(snippets)
+            session.add_message(snippets)
+            continue
+
+        # Query LLM with the user input, the summary is sent with every question and older questions are summarized
+        try:
+            print_stream(session.send(user_input))
+        except Exception as e:
+            # The question is dropped from the conversation, it can be asked again
+            logging.error(f"Chat request failed: {e}")
+
+    write_metrics(recorder, args.metrics_json)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,60 @@
+"""
+Compare the throughput of the clustering strategies on synthetic log lines.
+
+Usage: poetry run python benchmarks/bench_clustering.py [--lines N] [--templates N]
+"""
+
+import argparse
+import random
+import time
+from typing import List
+
+from core.incremental_clusterer import CLUSTER_STRATEGIES
+from core.log_clusterer import LogClusterer, get_log_entries
+
+FUZZ_THRESHOLD = 70
+
+WORDS = ["connection", "request", "broker", "session", "publish", "subscribe", "client", "topic", "timeout", "retry", "failed", "completed", "received", "sending", "message", "queue", "partition", "lease", "health", "check"]
+
+
+def make_templates(count: int, rng: random.Random) -> List[str]:
+    templates = []
+    for _ in range(count):
+        words = rng.sample(WORDS, rng.randint(4, 8))
+        words.insert(rng.randint(1, len(words)), "id={id}")
+        words.insert(rng.randint(1, len(words)), "from {ip}")
+        words.append("after {ms}ms")
+        templates.append(" ".join(words))
+    return templates
+
+
+def make_lines(line_count: int, template_count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    templates = make_templates(template_count, rng)
+    lines = []
+    for i in range(line_count):
+        template = templates[rng.randrange(len(templates))]
+        timestamp = f"2024-01-01T00:{(i // 60) % 60:02d}:{i % 60:02d}.{i % 1000:03d}Z"
+        ip = f"10.0.{rng.randint(0, 255)}.{rng.randint(0, 255)}"
+        lines.append(f"{timestamp} INFO " + template.format(id=rng.getrandbits(32), ip=ip, ms=rng.randint(1, 5000)))
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark log clustering strategies.")
+    parser.add_argument("--lines", type=int, default=20000, help="Number of synthetic log lines")
+    parser.add_argument("--templates", type=int, default=200, help="Number of distinct message templates")
+    args = parser.parse_args()
+
+    lines = make_lines(args.lines, args.templates)
+    print(f"{args.lines} lines, {args.templates} templates")
+    for name in CLUSTER_STRATEGIES:
+        entries = get_log_entries(lines, "ns/component/pod.bench.main.log")
+        start = time.perf_counter()
+        clusters = LogClusterer(FUZZ_THRESHOLD, name).cluster(entries)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: {len(clusters):>6} clusters {elapsed:8.3f}s {len(lines) / elapsed:12.0f} lines/sec")
+
+
+if __name__ == "__main__":
+    main()
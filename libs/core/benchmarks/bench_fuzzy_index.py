@@ -0,0 +1,63 @@
+"""
+Compare fuzzy clustering through the FuzzyIndex against the original linear scan over all
+cluster representatives, and check that both produce the same clusters.
+
+Usage: poetry run python benchmarks/bench_fuzzy_index.py [--lines N ...] [--templates N] [--skip-linear-above N]
+"""
+
+import argparse
+import time
+from typing import List
+
+from bench_clustering import FUZZ_THRESHOLD, make_lines
+from core.log_clusterer import fuzzy_match_entries, get_log_entries
+from core.log_entry import LogEntry
+from rapidfuzz import fuzz
+
+
+def linear_match_entries(entries: List[LogEntry], threshold: float) -> List[LogEntry]:
+    """The original greedy loop, scoring every entry against every representative."""
+    clusters: List[LogEntry] = []
+    for entry in entries:
+        for cluster in clusters:
+            if fuzz.ratio(entry.message, cluster.message) >= threshold:
+                cluster.merge(entry)
+                break
+        else:
+            clusters.append(entry)
+    return clusters
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the fuzzy clustering index.")
+    parser.add_argument("--lines", type=int, nargs="+", default=[100000, 1000000], help="Corpus sizes to benchmark")
+    parser.add_argument("--templates", type=int, default=1000, help="Number of distinct message templates")
+    parser.add_argument("--skip-linear-above", type=int, default=100000, help="Skip the linear scan for larger corpora")
+    args = parser.parse_args()
+
+    for line_count in args.lines:
+        lines = make_lines(line_count, args.templates)
+        print(f"{line_count} lines, {args.templates} templates")
+
+        entries = get_log_entries(lines, "ns/component/pod.bench.main.log")
+        start = time.perf_counter()
+        indexed = fuzzy_match_entries(entries, FUZZ_THRESHOLD)
+        indexed_elapsed = time.perf_counter() - start
+        print(f"  indexed: {len(indexed):>6} clusters {indexed_elapsed:8.3f}s {line_count / indexed_elapsed:12.0f} lines/sec")
+
+        if line_count > args.skip_linear_above:
+            continue
+
+        entries = get_log_entries(lines, "ns/component/pod.bench.main.log")
+        start = time.perf_counter()
+        linear = linear_match_entries(entries, FUZZ_THRESHOLD)
+        linear_elapsed = time.perf_counter() - start
+        print(f"   linear: {len(linear):>6} clusters {linear_elapsed:8.3f}s {line_count / linear_elapsed:12.0f} lines/sec")
+        print(f"  speedup: {linear_elapsed / indexed_elapsed:.1f}x")
+
+        same = [entry.message for entry in indexed] == [entry.message for entry in linear] and all(list(a.references) == list(b.references) for a, b in zip(indexed, linear))
+        print(f"  identical clusters: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Cluster a support bundle and report the wall time and peak RSS of the process.
+
+Usage: poetry run python benchmarks/bench_memory.py <bundle zip or directory> [--namespace NS] [--strategy NAME]
+"""
+
+import argparse
+import resource
+import time
+
+from core.filesystem import FileSystem
+from core.log_clusterer import LogClusterer
+
+FUZZ_THRESHOLD = 70
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure the peak memory of clustering a bundle.")
+    parser.add_argument("path", help="Path to the root folder containing log files or a support bundle zip")
+    parser.add_argument("--namespace", default="azure-iot-operations", help="Namespace to cluster")
+    parser.add_argument("--strategy", default="template", help="Log clustering strategy")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    clusters = LogClusterer(FUZZ_THRESHOLD, args.strategy).cluster_files(FileSystem(args.path), args.namespace)
+    elapsed = time.perf_counter() - start
+
+    references = sum(len(entry.references) for entry in clusters)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{len(clusters)} clusters, {references} references, {elapsed:.2f}s, peak RSS {peak_rss_mb:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark the pipeline stages on generated support bundles, with a local fake in place of the LLM
+so it runs offline. Results can be saved as JSON to compare releases.
+
+Usage: poetry run python benchmarks/bench_suite.py [--lines N ...] [--benchmarks NAME ...] [--repeat N] [--json FILE]
+    [--skip-fuzzy-above N], e.g. --lines 10000 100000 1000000 for the full suite, bundle options match bundle_generator.py
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from bench_clustering import FUZZ_THRESHOLD
+from bundle_generator import LINE_FORMATS, NAMESPACE, generate_bundle
+from core.filesystem import FileSystem
+from core.incremental_clusterer import CLUSTER_STRATEGIES
+from core.log_clusterer import LogClusterer, fuzzy_match_entries, get_log_entries
+from core.log_contextualizer import LogContextualizer
+from core.log_entry import LogEntry
+from core.log_filter import LogFilter
+from core.log_summarizer import LogSummarizer
+from fake_llm import FakeLLM
+
+
+# Inputs shared by the benchmarks of a bundle, each is computed once outside of the timed code
+class BundleContext:
+    def __init__(self, path: str, strategy: str, workers: int) -> None:
+        self.fs = FileSystem(path)
+        self.files = [file for file in self.fs.list_files() if file.endswith(".log")]
+        self.strategy = strategy
+        self.workers = workers
+        self.lines: Dict[str, List[str]] = {file: self.fs.read_file(file) for file in self.files}
+        self.line_count = sum(len(lines) for lines in self.lines.values())
+        self.clusters = LogClusterer(FUZZ_THRESHOLD, strategy).cluster_files(self.fs, NAMESPACE)
+        self.failures = LogFilter().error_entries(self.clusters)
+        self.context_entries = LogContextualizer().contextualize(self.failures)
+
+    def get_entries(self) -> List[LogEntry]:
+        return [entry for file, lines in self.lines.items() for entry in get_log_entries(lines, file)]
+
+
+def bench_read_file(context: BundleContext) -> Callable[[], Any]:
+    return lambda: [context.fs.read_file(file) for file in context.files]
+
+
+def bench_get_log_entries(context: BundleContext) -> Callable[[], Any]:
+    return context.get_entries
+
+
+def bench_fuzzy_match_entries(context: BundleContext) -> Callable[[], Any]:
+    # Clustering merges the entries, so each run gets new ones
+    entries = context.get_entries()
+    return lambda: fuzzy_match_entries(entries, FUZZ_THRESHOLD)
+
+
+def bench_cluster_files(context: BundleContext) -> Callable[[], Any]:
+    return lambda: LogClusterer(FUZZ_THRESHOLD, context.strategy, workers=context.workers).cluster_files(context.fs, NAMESPACE)
+
+
+def bench_contextualize(context: BundleContext) -> Callable[[], Any]:
+    return lambda: LogContextualizer().contextualize(context.clusters)
+
+
+def bench_filter(context: BundleContext) -> Callable[[], Any]:
+    return lambda: LogFilter().error_entries(context.clusters)
+
+
+def bench_summarize(context: BundleContext) -> Callable[[], Any]:
+    return lambda: LogSummarizer().summarize(context.context_entries)
+
+
+# Benchmark name -> setup returning the function to time, setups are not timed
+BENCHMARKS: Dict[str, Callable[[BundleContext], Callable[[], Any]]] = {
+    "read_file": bench_read_file,
+    "get_log_entries": bench_get_log_entries,
+    "fuzzy_match_entries": bench_fuzzy_match_entries,
+    "cluster_files": bench_cluster_files,
+    "contextualize": bench_contextualize,
+    "filter": bench_filter,
+    "summarize": bench_summarize,
+}
+
+
+def run_benchmark(context: BundleContext, name: str, repeat: int) -> Dict[str, Any]:
+    """Time a benchmark `repeat` times and return the best run."""
+    timings = []
+    for _ in range(repeat):
+        run = BENCHMARKS[name](context)
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {"benchmark": name, "lines": context.line_count, "seconds": best, "lines_per_second": context.line_count / best if best else 0.0}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on generated support bundles.")
+    parser.add_argument("--lines", type=int, nargs="+", default=[10000, 100000], help="Bundle sizes in lines")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS), help="Benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each benchmark, the best is reported")
+    parser.add_argument("--templates", type=int, default=200, help="Number of distinct message templates")
+    parser.add_argument("--variable-density", type=float, default=0.3, help="Fraction of template tokens that vary between lines")
+    parser.add_argument("--timestamp-formats", nargs="+", choices=list(LINE_FORMATS), default=list(LINE_FORMATS), help="Line formats, each file uses one")
+    parser.add_argument("--pods", type=int, default=16, help="Number of log files")
+    parser.add_argument("--strategy", choices=list(CLUSTER_STRATEGIES), default="template", help="Clustering strategy of cluster_files")
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes of cluster_files")
+    parser.add_argument("--skip-fuzzy-above", type=int, default=10000, help="Skip fuzzy_match_entries for larger bundles, it is quadratic in the clusters")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    # The LLM client is created on the first request, after the environment points it at the fake
+    fake_llm = FakeLLM().start()
+    os.environ.update(fake_llm.get_environment())
+
+    results = []
+    for line_count in args.lines:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "bundle.zip")
+            generate_bundle(path, line_count, args.templates, args.variable_density, args.timestamp_formats, args.pods)
+            context = BundleContext(path, args.strategy, args.jobs)
+            print(f"{context.line_count} lines, {len(context.files)} files, {len(context.clusters)} clusters, {len(context.failures)} failures")
+            for name in args.benchmarks:
+                if name == "fuzzy_match_entries" and line_count > args.skip_fuzzy_above:
+                    continue
+                result = run_benchmark(context, name, args.repeat)
+                results.append(result)
+                print(f"{name:>20}: {result['seconds']:8.3f}s {result['lines_per_second']:12.0f} lines/sec")
+            context.fs.zip_file.close()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    fake_llm.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Compare timestamp extraction: the original single pattern search, trying every known format
+on each line, and a per-file TimestampParser that only uses the detected format.
+
+Usage: poetry run python benchmarks/bench_timestamp.py [--lines N]
+"""
+
+import argparse
+import re
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from core.timestamp import TimestampParser, parse_timestamp
+
+SAMPLE_LINES: Dict[str, str] = {
+    "iso8601": "2024-01-01T00:00:{second:02d}.123Z INFO broker session connected client=abc",
+    "rfc3339_nano": "2024-01-01T00:00:{second:02d}.123456789Z stdout F level=info msg=publishing",
+    "klog": "I0101 00:00:{second:02d}.123456    4711 controller.go:42] Reconciling resource name=broker",
+    "epoch": "17040672{second:02d}.123 INFO reconciled",
+    "zap_json": '{{"level":"info","ts":17040672{second:02d}.123,"msg":"reconciled"}}',
+    "logfmt": 'level=info time="2024-01-01T00:00:{second:02d}Z" msg="reconciled"',
+}
+
+
+def original_get_timestamp(text: str) -> Optional[datetime]:
+    """The original extraction, rebuilding the pattern list and searching on every call."""
+    timestamp_patterns = [
+        r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z",
+    ]
+    for pattern in timestamp_patterns:
+        match = re.search(pattern, text)
+        if match:
+            try:
+                return datetime.fromisoformat(match.group(0))
+            except ValueError:
+                pass
+    return None
+
+
+def measure(lines: List[str], parse: Callable[[str], Optional[datetime]]) -> str:
+    start = time.perf_counter()
+    found = sum(1 for line in lines if parse(line))
+    elapsed = time.perf_counter() - start
+    return f"{found * 100 // len(lines):>3}% found {len(lines) / elapsed:>10.0f} lines/sec"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark timestamp extraction.")
+    parser.add_argument("--lines", type=int, default=100000, help="Number of lines per format")
+    args = parser.parse_args()
+
+    for name, template in SAMPLE_LINES.items():
+        lines = [template.format(second=i % 60) for i in range(args.lines)]
+        print(f"{name}:")
+        print(f"  original:   {measure(lines, original_get_timestamp)}")
+        print(f"  all formats: {measure(lines, parse_timestamp)}")
+        print(f"  per file:   {measure(lines, TimestampParser().parse)}")
+
+
+if __name__ == "__main__":
+    main()
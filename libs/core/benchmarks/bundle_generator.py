@@ -0,0 +1,177 @@
+"""
+Generate synthetic support bundles: `namespace/component/pod.<name>.<container>.log` trees of
+log lines drawn from random message templates, as a directory or a zip.
+
+Usage: poetry run python benchmarks/bundle_generator.py <output directory or .zip> [--lines N] [--templates N]
+    [--variable-density F] [--timestamp-formats NAME ...] [--pods N] [--error-fraction F] [--seed N]
+"""
+
+import argparse
+import json
+import random
+import zipfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+NAMESPACE = "azure-iot-operations"
+
+# Component -> containers, pods of a component share its containers
+COMPONENTS: Dict[str, List[str]] = {
+    "broker": ["frontend", "backend", "health-manager"],
+    "opcua": ["opc-supervisor", "connector"],
+    "dataflow": ["dataflow", "operator"],
+    "meta": ["operator"],
+    "deviceregistry": ["controller"],
+    "schemaregistry": ["registry"],
+}
+
+WORDS = ["connection", "request", "broker", "session", "publish", "subscribe", "client", "topic", "retry", "completed", "received", "sending", "message", "queue", "partition", "lease", "health", "check", "reconcile", "asset", "endpoint", "status", "update", "sync"]
+FAILURE_WORDS = ["failed", "error", "timeout", "refused", "unavailable", "QuotaExceeded", "denied", "reset"]
+
+VARIABLES: List[Callable[[random.Random], str]] = [
+    lambda rng: str(rng.randint(0, 100000)),
+    lambda rng: f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}:{rng.randint(1024, 65535)}",
+    lambda rng: "%08x-%04x-%04x-%04x-%012x" % (rng.getrandbits(32), rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(16), rng.getrandbits(48)),
+    lambda rng: f"0x{rng.getrandbits(32):08x}",
+    lambda rng: f"{rng.randint(1, 5000)}ms",
+]
+VARIABLE = "{}"
+
+KLOG_LEVELS = {"debug": "I", "info": "I", "warning": "W", "error": "E"}
+
+
+def format_iso8601(timestamp: datetime, level: str, message: str) -> str:
+    return f"{timestamp.strftime('%Y-%m-%dT%H:%M:%S')}.{timestamp.microsecond // 1000:03d}Z {level.upper()} {message}"
+
+
+def format_rfc3339_nano(timestamp: datetime, level: str, message: str) -> str:
+    return f"{timestamp.strftime('%Y-%m-%dT%H:%M:%S')}.{timestamp.microsecond:06d}123Z stdout F level={level} msg=\"{message}\""
+
+
+def format_klog(timestamp: datetime, level: str, message: str) -> str:
+    return f"{KLOG_LEVELS[level]}{timestamp.strftime('%m%d %H:%M:%S')}.{timestamp.microsecond:06d}       1 controller.go:42] {message}"
+
+
+def format_epoch(timestamp: datetime, level: str, message: str) -> str:
+    return f"{timestamp.timestamp():.3f} {level.upper()} {message}"
+
+
+def format_zap_json(timestamp: datetime, level: str, message: str) -> str:
+    return json.dumps({"level": level, "ts": round(timestamp.timestamp(), 3), "msg": message})
+
+
+def format_logfmt(timestamp: datetime, level: str, message: str) -> str:
+    return f"level={level} time=\"{timestamp.strftime('%Y-%m-%dT%H:%M:%S')}Z\" msg=\"{message}\""
+
+
+LINE_FORMATS: Dict[str, Callable[[datetime, str, str], str]] = {
+    "iso8601": format_iso8601,
+    "rfc3339_nano": format_rfc3339_nano,
+    "klog": format_klog,
+    "epoch": format_epoch,
+    "zap_json": format_zap_json,
+    "logfmt": format_logfmt,
+}
+
+
+def make_templates(count: int, variable_density: float, error_fraction: float, rng: random.Random) -> List[tuple[str, str]]:
+    """Return (level, template) pairs, `{}` marks the variable tokens of a template."""
+    templates = []
+    for _ in range(count):
+        level = "error" if rng.random() < error_fraction else rng.choice(["info", "info", "info", "debug", "warning"])
+        words = rng.sample(WORDS, rng.randint(4, 10))
+        if level in ["error", "warning"]:
+            words.insert(rng.randint(0, len(words)), rng.choice(FAILURE_WORDS))
+        tokens = [VARIABLE if rng.random() < variable_density else word for word in words]
+        templates.append((level, " ".join(tokens)))
+    return templates
+
+
+def make_message(template: str, rng: random.Random) -> str:
+    return template.format(*(rng.choice(VARIABLES)(rng) for _ in range(template.count(VARIABLE))))
+
+
+def get_pod_files(pods: int, rng: random.Random) -> List[str]:
+    files = []
+    components = list(COMPONENTS)
+    for i in range(pods):
+        component = components[i % len(components)]
+        container = rng.choice(COMPONENTS[component])
+        files.append(f"{NAMESPACE}/{component}/pod.aio-{component}-{i}-{rng.getrandbits(24):06x}.{container}.log")
+    return files
+
+
+def generate_bundle(
+    path: str,
+    lines: int = 100000,
+    templates: int = 200,
+    variable_density: float = 0.3,
+    timestamp_formats: Sequence[str] = ("iso8601",),
+    pods: int = 16,
+    error_fraction: float = 0.1,
+    seed: int = 0,
+) -> List[str]:
+    """
+    Write a synthetic bundle and return the names of its log files.
+
+    :param path: Output directory, or a zip file if it ends with `.zip`.
+    :param lines: Total number of log lines across all files.
+    :param templates: Number of distinct message templates shared by all pods.
+    :param variable_density: Fraction of the tokens of a template that vary between lines.
+    :param timestamp_formats: Formats of the lines, each file uses one of them.
+    :param pods: Number of log files.
+    :param error_fraction: Fraction of templates that are errors.
+    :param seed: Random seed, the same arguments and seed produce the same bundle.
+    """
+    rng = random.Random(seed)
+    message_templates = make_templates(templates, variable_density, error_fraction, rng)
+    files = get_pod_files(pods, rng)
+    # Skew the lines across pods, some pods are much noisier than others
+    weights = [rng.paretovariate(1.5) for _ in files]
+    line_counts = [int(lines * weight / sum(weights)) for weight in weights]
+    line_counts[0] += lines - sum(line_counts)
+    # Zipf distributed templates, a few messages make up most of the lines like in real logs
+    template_weights = [1 / (rank + 1) for rank in range(len(message_templates))]
+
+    zip_file = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) if path.endswith(".zip") else None
+    try:
+        for i, (file, line_count) in enumerate(zip(files, line_counts)):
+            format_line = LINE_FORMATS[timestamp_formats[i % len(timestamp_formats)]]
+            timestamp = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=rng.randint(0, 3600))
+            text_lines = []
+            for level, template in rng.choices(message_templates, template_weights, k=line_count):
+                timestamp += timedelta(microseconds=rng.randint(0, 200000))
+                text_lines.append(format_line(timestamp, level, make_message(template, rng)))
+            content = "\n".join(text_lines) + "\n"
+
+            if zip_file:
+                zip_file.writestr(file, content)
+            else:
+                file_path = Path(path) / file
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                file_path.write_text(content, encoding="utf-8")
+    finally:
+        if zip_file:
+            zip_file.close()
+    return files
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic support bundle.")
+    parser.add_argument("path", help="Output directory, or a zip file if it ends with .zip")
+    parser.add_argument("--lines", type=int, default=100000, help="Total number of log lines")
+    parser.add_argument("--templates", type=int, default=200, help="Number of distinct message templates")
+    parser.add_argument("--variable-density", type=float, default=0.3, help="Fraction of template tokens that vary between lines")
+    parser.add_argument("--timestamp-formats", nargs="+", choices=list(LINE_FORMATS), default=["iso8601"], help="Line formats, each file uses one")
+    parser.add_argument("--pods", type=int, default=16, help="Number of log files")
+    parser.add_argument("--error-fraction", type=float, default=0.1, help="Fraction of templates that are errors")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    files = generate_bundle(args.path, args.lines, args.templates, args.variable_density, args.timestamp_formats, args.pods, args.error_fraction, args.seed)
+    print(f"Wrote {args.lines} lines in {len(files)} files to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
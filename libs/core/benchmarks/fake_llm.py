@@ -0,0 +1,139 @@
+"""
+Local stand-in for the Azure OpenAI chat completions API so the pipeline can be benchmarked offline.
+
+Filter prompts are answered with the ids of the entries that contain failure words, other prompts
+with a short fixed summary. `--latency` adds a delay to every response to approximate the service.
+
+Usage: poetry run python benchmarks/fake_llm.py [--port N] [--latency SECONDS]
+    then set AZURE_OPENAI_ENDPOINT=http://127.0.0.1:<port> and AZURE_OPENAI_API_KEY to any value.
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+FAILURE_PATTERN = re.compile(r"error|fail|timeout|refused|unavailable|exceeded|denied|reset", re.IGNORECASE)
+LOG_ENTRIES_PATTERN = re.compile(r"\{\"logEntries\": .*\}\s*$", re.DOTALL)
+SUMMARY = "## Context\n\nSynthetic summary.\n\n## Root Cause\n\nUnknown.\n\n## Action Items\n\nNone.\n\n## Next Steps & Customer Guidance\n\nNone.\n\n## Important Notes\n\nNone."
+
+
+def get_prompt_text(body: Dict[str, Any]) -> str:
+    content = body["messages"][-1]["content"]
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content)
+    return str(content)
+
+
+def create_response(prompt: str) -> str:
+    match = LOG_ENTRIES_PATTERN.search(prompt)
+    if match:
+        entries = json.loads(match.group(0))["logEntries"]
+        if entries and "messageID" in entries[0]:
+            failures = [entry["messageID"] for entry in entries if FAILURE_PATTERN.search(entry["message"])]
+            return "```json\n" + json.dumps({"failures": failures}) + "\n```"
+    return SUMMARY
+
+
+def create_chunks(content: str) -> List[Dict[str, Any]]:
+    """Split a response into streamed chunks of a few words, ending with a usage only chunk."""
+    words = content.split(" ")
+    chunks = [create_chunk([{"index": 0, "delta": {"content": " ".join(words[i : i + 4]) + " "}, "finish_reason": None}]) for i in range(0, len(words), 4)]
+    chunks.append(create_chunk([], usage={"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)}))
+    return chunks
+
+
+def create_chunk(choices: List[Dict[str, Any]], **fields: Any) -> Dict[str, Any]:
+    return {"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": "fake", "choices": choices, **fields}
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    # Connections are kept alive like the service's, so that clients can reuse them
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        prompt = get_prompt_text(body)
+        content = create_response(prompt)
+        if self.latency:
+            time.sleep(self.latency)
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("content-type", "text/event-stream")
+            self.send_header("transfer-encoding", "chunked")
+            self.end_headers()
+            for chunk in create_chunks(content):
+                self.write_chunk(b"data: " + json.dumps(chunk).encode() + b"\n\n")
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.write_chunk(b"")
+            return
+
+        prompt_tokens = len(json.dumps(body["messages"])) // 4
+        completion_tokens = len(content) // 4
+        response = {
+            "id": "fake",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "fake",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+        data = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def write_chunk(self, data: bytes) -> None:
+        """Write a chunk of a chunked response, an empty chunk ends the response."""
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+# Fake chat completions server running on a background thread
+class FakeLLM:
+    def __init__(self, port: int = 0, latency: float = 0.0) -> None:
+        handler = type("Handler", (FakeLLMHandler,), {"latency": latency})
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> "FakeLLM":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_environment(self) -> Dict[str, str]:
+        """Environment variables that point `core.llm` at the fake, they must be set before its first request."""
+        return {
+            "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{self.server.server_port}",
+            "AZURE_OPENAI_API_KEY": "fake",
+            "AZURE_DEPLOYMENT_NAME": "fake",
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a fake Azure OpenAI chat completions server.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    args = parser.parse_args()
+
+    fake = FakeLLM(args.port, args.latency).start()
+    for name, value in fake.get_environment().items():
+        print(f"export {name}={value}")
+    fake.thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,57 @@
-from .filesystem import FileSystem
-from .llm import get_last_message_content, query_llm
-from .log_clusterer import LogClusterer
-from .log_contextualizer import LogContextualizer
-from .log_filter import LogFilter
-from .prompt import get_prompt
+import importlib
+from typing import TYPE_CHECKING, Any, List
+
+# Exported name -> submodule. Submodules are imported when a name is first used, `import core` stays cheap
+# for callers that only need part of the package such as clustering.
+_EXPORTS = {
+    "FileSystem": ".filesystem",
+    "IncrementalClusterer": ".incremental_clusterer",
+    "LineIndex": ".line_index",
+    "get_last_message_content": ".llm",
+    "query_llm": ".llm",
+    "LogClusterer": ".log_clusterer",
+    "LogContextualizer": ".log_contextualizer",
+    "LogFilter": ".log_filter",
+    "LogSelection": ".log_selection",
+    "LogSummarizer": ".log_summarizer",
+    "get_prompt": ".prompt",
+}
+
+if TYPE_CHECKING:
+    from .filesystem import FileSystem
+    from .incremental_clusterer import IncrementalClusterer
+    from .line_index import LineIndex
+    from .llm import get_last_message_content, query_llm
+    from .log_clusterer import LogClusterer
+    from .log_contextualizer import LogContextualizer
+    from .log_filter import LogFilter
+    from .log_selection import LogSelection
+    from .log_summarizer import LogSummarizer
+    from .prompt import get_prompt
 
 __all__ = [
     "FileSystem",
+    "IncrementalClusterer",
+    "LineIndex",
     "get_last_message_content",
     "query_llm",
     "LogClusterer",
     "LogContextualizer",
     "LogFilter",
+    "LogSelection",
+    "LogSummarizer",
     "get_prompt",
 ]
+
+
+def __getattr__(name: str) -> Any:
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from array import array
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from .filesystem import FileSystem
+from .llm_cache import DEFAULT_CACHE_DIR
+
+if TYPE_CHECKING:
+    from .log_clusterer import CompactCluster
+
+# Bump when clustering or timestamp parsing changes so that older indexes are rebuilt
+INDEX_VERSION = 1
+INDEX_MAGIC = b"AETHIDX1"
+DEFAULT_INDEX_DIR = DEFAULT_CACHE_DIR / "index"
+
+FileKey = Tuple[int, int]
+
+# magic, header length
+PREFIX = struct.Struct("<8sQ")
+
+
+class _IndexedFile:
+    __slots__ = ["key", "messages", "counts", "offset", "clusters"]
+
+    def __init__(self, key: FileKey, messages: List[str], counts: List[int], offset: int = -1, clusters: Optional[List["CompactCluster"]] = None) -> None:
+        self.key = key
+        self.messages = messages
+        self.counts = counts
+        # Offset of the file's columns in the data section of the loaded index, -1 for files added in this run
+        self.offset = offset
+        self.clusters = clusters
+
+
+# On disk index of the per-file clusters of a bundle, so that files that have not changed since the previous
+# run are not read and clustered again. The index is a JSON header followed by the reference columns of every
+# file (int64 timestamps, then uint32 line numbers), the columns are read from a memory map only when used.
+class BundleIndex:
+    def __init__(self, path: Union[str, Path], threshold: float, strategy: str, time_window: Optional[List[Optional[str]]] = None) -> None:
+        """
+        :param path: Index file, it is created by `save` if it does not exist.
+        :param threshold: Similarity threshold of the clusterer, an index built with another configuration is ignored.
+        :param strategy: Clustering strategy of the clusterer.
+        :param time_window: Time window of the clustered lines, see `LogSelection.get_time_window`.
+        """
+        self.path = Path(path)
+        self.config = {"version": INDEX_VERSION, "threshold": threshold, "strategy": strategy, "time_window": time_window or [None, None]}
+        self.files: Dict[str, _IndexedFile] = {}
+        self.data: Optional[mmap.mmap] = None
+        self.data_start = 0
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @classmethod
+    def for_bundle(cls, fs: FileSystem, threshold: float, strategy: str, index_dir: Union[str, Path, None] = None, time_window: Optional[List[Optional[str]]] = None) -> "BundleIndex":
+        """Return the index of a bundle in `index_dir`, keyed by the bundle path and the clusterer configuration."""
+        key = json.dumps([str(fs.path.resolve()), INDEX_VERSION, threshold, strategy, time_window or [None, None]])
+        name = hashlib.sha256(key.encode()).hexdigest()[:32]
+        return cls(Path(index_dir or DEFAULT_INDEX_DIR) / f"{name}.idx", threshold, strategy, time_window)
+
+    def get(self, file: str, key: FileKey) -> Optional[List["CompactCluster"]]:
+        """Return the clusters of a file if they were indexed for the same file `key`, see `FileSystem.get_file_key`."""
+        indexed = self.files.get(file)
+        if indexed is None or indexed.key != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if indexed.clusters is None:
+            indexed.clusters = self._read_clusters(indexed)
+        return indexed.clusters
+
+    def put(self, file: str, key: FileKey, clusters: List["CompactCluster"]) -> None:
+        self.files[file] = _IndexedFile(key, [message for message, _, _ in clusters], [len(lines) for _, lines, _ in clusters], clusters=clusters)
+
+    def retain(self, files: Iterable[str]) -> None:
+        """Drop the files that are not in `files`, such as files that were removed from the bundle."""
+        keep = set(files)
+        self.files = {file: indexed for file, indexed in self.files.items() if file in keep}
+
+    def save(self) -> None:
+        """Write the index, replacing the file atomically."""
+        header_files: Dict[str, Any] = {}
+        columns: List[Tuple[bytes, bytes]] = []
+        offset = 0
+        for file, indexed in self.files.items():
+            timestamps, lines = self._get_column_bytes(indexed)
+            header_files[file] = {"key": list(indexed.key), "messages": indexed.messages, "counts": indexed.counts, "offset": offset}
+            columns.append((timestamps, lines))
+            # Keep the next file's int64 column aligned
+            offset += len(timestamps) + len(lines) + (-len(lines) % 8)
+
+        header = json.dumps({**self.config, "files": header_files}).encode()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(PREFIX.pack(INDEX_MAGIC, len(header)))
+            f.write(header)
+            f.write(bytes(-(PREFIX.size + len(header)) % 8))
+            for timestamps, lines in columns:
+                f.write(timestamps)
+                f.write(lines)
+                f.write(bytes(-len(lines) % 8))
+
+        # Reload from the new file, clusters returned by `get` are copies and stay valid
+        self.close()
+        os.replace(tmp_path, self.path)
+        self._load()
+
+    def close(self) -> None:
+        if self.data:
+            self.data.close()
+            self.data = None
+        self.files = {}
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"files": len(self.files), "hits": self.hits, "misses": self.misses}
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                return
+
+        # A corrupt or truncated index is ignored and rebuilt by `save`
+        try:
+            magic, header_length = PREFIX.unpack_from(data)
+            header = json.loads(data[PREFIX.size : PREFIX.size + header_length]) if magic == INDEX_MAGIC else {}
+            if {key: header.get(key) for key in self.config} != self.config:
+                data.close()
+                return
+            data_start = PREFIX.size + header_length + (-(PREFIX.size + header_length) % 8)
+            files: Dict[str, _IndexedFile] = {}
+            for file, indexed in header["files"].items():
+                files[file] = _IndexedFile((int(indexed["key"][0]), int(indexed["key"][1])), indexed["messages"], indexed["counts"], int(indexed["offset"]))
+                if len(files[file].messages) != len(files[file].counts) or data_start + files[file].offset + 12 * sum(files[file].counts) > len(data):
+                    raise ValueError(f"Columns of {file} are out of range")
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError, struct.error):
+            data.close()
+            return
+
+        self.data = data
+        self.data_start = data_start
+        self.files = files
+
+    def _get_column_bytes(self, indexed: _IndexedFile) -> Tuple[bytes, bytes]:
+        if indexed.clusters is None and self.data:
+            # Unused files are copied over without decoding their columns
+            total = sum(indexed.counts)
+            start = self.data_start + indexed.offset
+            return self.data[start : start + 8 * total], self.data[start + 8 * total : start + 12 * total]
+
+        timestamps = array("q")
+        lines = array("I")
+        for _, cluster_lines, cluster_timestamps in indexed.clusters or []:
+            timestamps.extend(cluster_timestamps)
+            lines.extend(cluster_lines)
+        return timestamps.tobytes(), lines.tobytes()
+
+    def _read_clusters(self, indexed: _IndexedFile) -> List["CompactCluster"]:
+        assert self.data is not None
+        view = memoryview(self.data)
+        total = sum(indexed.counts)
+        timestamps_start = self.data_start + indexed.offset
+        lines_start = timestamps_start + 8 * total
+
+        clusters: List["CompactCluster"] = []
+        position = 0
+        for message, count in zip(indexed.messages, indexed.counts):
+            timestamps = array("q")
+            timestamps.frombytes(view[timestamps_start + 8 * position : timestamps_start + 8 * (position + count)])
+            lines = array("I")
+            lines.frombytes(view[lines_start + 4 * position : lines_start + 4 * (position + count)])
+            clusters.append((message, lines, timestamps))
+            position += count
+        view.release()
+        return clusters
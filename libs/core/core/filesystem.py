@@ -1,11 +1,29 @@
+import io
+import itertools
+import queue
+import threading
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Union
+from typing import IO, Callable, Deque, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Number of threads reading files ahead of the caller in `iter_files`
+READ_THREADS = 4
+# Bytes read from a file at a time in `iter_files`, and the number of blocks of a file read ahead of the caller
+READ_BLOCK_SIZE = 1 << 20
+READ_AHEAD_BLOCKS = 4
 
 
 class FileSystem:
-    def __init__(self, path: Union[str, Path]) -> None:
+    def __init__(self, path: Union[str, Path], errors: str = "replace") -> None:
+        """
+        :param path: Path to a directory or a ZIP file.
+        :param errors: How undecodable bytes are handled when reading files, see `codecs` error handlers.
+        """
         self.path = Path(path)
+        self.errors = errors
         if self.path.is_file() and self.path.suffix == ".zip":
             self.zip_mode = True
             self.zip_file = zipfile.ZipFile(self.path, "r")
@@ -25,15 +43,158 @@ class FileSystem:
         Return the contents of `file_name` as a list of strings (one for each line).
         Trailing slashes are removed to ensure correct handling of directories vs. files.
         """
+        return list(self.iter_lines(file_name))
+
+    def iter_lines(self, file_name: str, errors: Optional[str] = None) -> Iterator[str]:
+        """
+        Yield the lines of `file_name` without line endings, decoding incrementally so that only
+        a small buffer of the file is held in memory.
+
+        :param file_name: The name of the file to read.
+        :param errors: How undecodable bytes are handled, defaults to the file system setting.
+        """
         file_name = file_name.rstrip("/\\")  # Remove any trailing slashes
+        errors = errors or self.errors
 
         if self.zip_mode:
-            with self.zip_file.open(file_name, "r") as f:
-                return f.read().decode("utf-8").splitlines()
+            with self.zip_file.open(file_name, "r") as raw:
+                yield from iter_text_lines(raw, errors)
         else:
-            with open(self.path / file_name, "r", encoding="utf-8") as f:
-                return f.read().splitlines()
+            with open(self.path / file_name, "rb") as raw:
+                yield from iter_text_lines(raw, errors)
+
+    def iter_files(self, file_names: Sequence[str], threads: int = READ_THREADS) -> Iterator[Tuple[str, Iterator[str]]]:
+        """
+        Yield the names and lines of files, decoded like `iter_lines`, while the next `threads` files are read on
+        background threads. Files are read in blocks and at most `READ_AHEAD_BLOCKS` blocks of a file are held ahead
+        of the caller, so memory use doesn't depend on the size of the files. The lines of a file must be consumed
+        before the next file is requested. `ZipFile` is not thread safe, so each thread reads zip members with its
+        own handle.
+        """
+        local = threading.local()
+        handles: List[zipfile.ZipFile] = []
+        handles_lock = threading.Lock()
+
+        def open_file(file_name: str) -> IO[bytes]:
+            file_name = file_name.rstrip("/\\")
+            if not self.zip_mode:
+                return open(self.path / file_name, "rb")
+            zip_file = getattr(local, "zip_file", None)
+            if zip_file is None:
+                zip_file = zipfile.ZipFile(self.path, "r")
+                local.zip_file = zip_file
+                with handles_lock:
+                    handles.append(zip_file)
+            return zip_file.open(file_name, "r")
+
+        pending: Deque[Tuple[str, _ReadAhead]] = deque()
+        names = iter(file_names)
+        try:
+            with ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+
+                def start(file_name: str) -> None:
+                    stream = _ReadAhead()
+                    executor.submit(stream.fill, lambda: open_file(file_name))
+                    pending.append((file_name, stream))
+
+                try:
+                    for file_name in itertools.islice(names, max(threads, 1)):
+                        start(file_name)
+                    while pending:
+                        file_name, stream = pending.popleft()
+                        next_name = next(names, None)
+                        if next_name is not None:
+                            start(next_name)
+                        try:
+                            yield file_name, iter_text_lines(io.BufferedReader(stream, READ_BLOCK_SIZE), self.errors)
+                        finally:
+                            stream.cancel()
+                finally:
+                    # Stop reading ahead when the caller stops early
+                    for _, stream in pending:
+                        stream.cancel()
+        finally:
+            for zip_file in handles:
+                zip_file.close()
+
+    def get_file_key(self, file_name: str) -> Tuple[int, int]:
+        """
+        Return a key that changes when the file changes: the size and CRC-32 of a zip member,
+        or the size and modification time of a file in a directory.
+        """
+        file_name = file_name.rstrip("/\\")
+        if self.zip_mode:
+            info = self.zip_file.getinfo(file_name)
+            return info.file_size, info.CRC
+        stat = (self.path / file_name).stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    def get_file_time(self, file_name: str) -> datetime:
+        """
+        Return the last modification time of a file, such as the time a log was collected into the bundle.
+        The dates of zip members have no time zone and are treated as UTC.
+        """
+        file_name = file_name.rstrip("/\\")
+        if self.zip_mode:
+            return datetime(*self.zip_file.getinfo(file_name).date_time, tzinfo=timezone.utc)
+        return datetime.fromtimestamp((self.path / file_name).stat().st_mtime, timezone.utc)
 
     def __del__(self) -> None:
         if self.zip_mode:
             self.zip_file.close()
+
+
+# Binary stream of a file that is read in blocks on another thread, see `fill`. The reading thread waits when
+# `READ_AHEAD_BLOCKS` blocks are queued, so only a few blocks of the file are in memory at a time.
+class _ReadAhead(io.RawIOBase):
+    def __init__(self) -> None:
+        # Blocks of the file, then an empty block at its end or the error that stopped the read
+        self.blocks: "queue.Queue[Union[bytes, BaseException]]" = queue.Queue(READ_AHEAD_BLOCKS)
+        self.cancelled = threading.Event()
+        self.block = memoryview(b"")
+        self.done = False
+
+    def fill(self, open_file: Callable[[], IO[bytes]]) -> None:
+        """Read the file into the queue of blocks, runs on a background thread."""
+        try:
+            if self.cancelled.is_set():
+                return
+            with open_file() as raw:
+                while not self.cancelled.is_set():
+                    block = raw.read(READ_BLOCK_SIZE)
+                    self.blocks.put(block)
+                    if not block:
+                        return
+        except BaseException as e:
+            self.blocks.put(e)
+
+    def cancel(self) -> None:
+        """Stop reading. Queued blocks are dropped so that a reading thread waiting for space wakes up and stops."""
+        self.cancelled.set()
+        try:
+            while True:
+                self.blocks.get_nowait()
+        except queue.Empty:
+            pass
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: "memoryview") -> int:  # type: ignore[override]
+        if not self.block and not self.done:
+            item = self.blocks.get()
+            if isinstance(item, BaseException):
+                raise item
+            self.done = not item
+            self.block = memoryview(item)
+        size = min(len(buffer), len(self.block))
+        buffer[:size] = self.block[:size]
+        self.block = self.block[size:]
+        return size
+
+
+def iter_text_lines(raw: IO[bytes], errors: str) -> Iterator[str]:
+    """Decode a binary stream as UTF-8 and yield its lines without line endings."""
+    with io.TextIOWrapper(raw, encoding="utf-8", errors=errors) as f:
+        for line in f:
+            yield line.rstrip("\n")
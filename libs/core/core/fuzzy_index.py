@@ -0,0 +1,166 @@
+import bisect
+import itertools
+import math
+from operator import itemgetter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .log_entry import LogEntry
+from rapidfuzz import fuzz, process
+
+# Number of candidates scored in the first rapidfuzz call of a lookup, doubled for each following call
+FIND_CHUNK_SIZE = 32
+
+# Number of leading words of a message that make up its key, see `get_message_key`
+KEY_WORDS = 3
+
+
+# Index over cluster representatives for greedy fuzzy clustering.
+#
+# fuzz.ratio is 100 * (1 - indel_distance / (len1 + len2)) and the indel distance is at least
+# the length difference, so a representative can only reach the threshold if its length falls
+# in a band around the length of the message. Representatives are bucketed by length and only
+# the buckets inside the band are scored, oldest first, in batched rapidfuzz calls.
+#
+# At low thresholds the band holds most representatives, so they are also bucketed by the leading words of their
+# message. When the oldest candidates do not match, the bucket of the message is scored next. A match there is
+# usually the cluster the message belongs to, and the rest of the band scan only has to score the representatives
+# older than it, which keeps the result the same as a scan of the whole band. When the band holds every length the
+# candidates are a plain slice of the representatives, without collecting and sorting the length buckets.
+class FuzzyIndex:
+    def __init__(self, threshold: float) -> None:
+        """
+        :param threshold: Minimum fuzz.ratio (0-100) for a message to join a cluster.
+        """
+        self.threshold = threshold
+        self.clusters: List[LogEntry] = []
+        self.messages: List[str] = []
+        # Sorted distinct representative lengths and length -> cluster indexes
+        self.lengths: List[int] = []
+        self.buckets: Dict[int, List[int]] = {}
+        # Message key -> cluster indexes, see `get_message_key`
+        self.key_buckets: Dict[str, List[int]] = {}
+        # Message -> cluster index, a repeated message always lands in the same cluster
+        self.message_lookup: Dict[str, int] = {}
+
+    def add(self, entry: LogEntry) -> LogEntry:
+        """
+        Add an entry to the index. Returns the cluster representative the entry was merged into,
+        or the entry itself if it started a new cluster.
+        """
+        index = self.find(entry.message)
+        if index is None:
+            self.add_cluster(entry)
+            return entry
+
+        cluster = self.clusters[index]
+        cluster.merge(entry)
+        self.message_lookup[entry.message] = index
+        return cluster
+
+    def find(self, message: str) -> Optional[int]:
+        """
+        Return the index of the first (oldest) cluster whose representative matches the message,
+        the same cluster a linear scan over all representatives would pick, or None.
+        """
+        known = self.message_lookup.get(message)
+        if known is not None:
+            return known
+
+        low, high = self._length_band(len(message))
+        indexes: Sequence[int]
+        if self.lengths and low <= self.lengths[0] and high >= self.lengths[-1]:
+            # Every representative is in the band
+            indexes = range(len(self.messages))
+        else:
+            indexes = []
+            for length in self.lengths[bisect.bisect_left(self.lengths, low) : bisect.bisect_right(self.lengths, high)]:
+                indexes.extend(self.buckets[length])
+            indexes.sort()
+
+        found = self._find_first(message, indexes[:FIND_CHUNK_SIZE])
+        if found is not None or len(indexes) <= FIND_CHUNK_SIZE:
+            return found
+
+        # The oldest match in the bucket of the message key bounds the result, only older clusters can still win
+        indexes = indexes[FIND_CHUNK_SIZE:]
+        end = None
+        key_indexes = [index for index in self.key_buckets.get(get_message_key(message), []) if index >= indexes[0] and low <= len(self.messages[index]) <= high]
+        if key_indexes:
+            end = self._find_first(message, key_indexes)
+            if end is not None:
+                indexes = indexes[: bisect.bisect_left(indexes, end)]
+        found = self._find_first(message, indexes, FIND_CHUNK_SIZE * 2)
+        return found if found is not None else end
+
+    def _find_first(self, message: str, indexes: Sequence[int], chunk_size: int = FIND_CHUNK_SIZE) -> Optional[int]:
+        """Return the first of the ascending cluster indexes whose representative matches the message, or None."""
+        # Score the candidates oldest first in growing chunks, stopping at the first chunk with a match
+        start = 0
+        while start < len(indexes):
+            chunk = indexes[start : start + chunk_size]
+            if isinstance(chunk, range):
+                choices: Sequence[str] = self.messages[chunk.start : chunk.stop]
+            else:
+                choices = [self.messages[chunk[0]]] if len(chunk) == 1 else itemgetter(*chunk)(self.messages)
+            matches = process.extract(message, choices, scorer=fuzz.ratio, score_cutoff=self.threshold, limit=None)
+            if matches:
+                return min(chunk[match[2]] for match in matches)
+            start += chunk_size
+            chunk_size *= 2
+        return None
+
+    def get_entries(self) -> List[LogEntry]:
+        """Return the cluster representatives in the order they were created."""
+        return self.clusters
+
+    def add_cluster(self, entry: LogEntry) -> None:
+        """Add an entry as a new cluster without matching it."""
+        index = len(self.clusters)
+        self.clusters.append(entry)
+        self.messages.append(entry.message)
+        self.message_lookup[entry.message] = index
+
+        length = len(entry.message)
+        bucket = self.buckets.get(length)
+        if bucket is None:
+            bucket = []
+            self.buckets[length] = bucket
+            bisect.insort(self.lengths, length)
+        bucket.append(index)
+        self.key_buckets.setdefault(get_message_key(entry.message), []).append(index)
+
+    def get_state(self) -> Dict[str, Any]:
+        """Return the message lookup of the index as JSON serializable data, such as for a checkpoint."""
+        return {"message_lookup": self.message_lookup}
+
+    def set_state(self, entries: List[LogEntry], state: Dict[str, Any]) -> None:
+        """
+        Restore the clusters of an index from the data returned by its `get_state`.
+
+        :param entries: The cluster representatives, in the order of `get_entries`.
+        :param state: The state of the index.
+        """
+        for entry in entries:
+            self.add_cluster(entry)
+        self.message_lookup = dict(state["message_lookup"])
+
+    def _length_band(self, length: int) -> Tuple[float, float]:
+        """Return the range of representative lengths that can reach the threshold."""
+        ratio = self.threshold / 100
+        if ratio <= 0:
+            return 0, math.inf
+        if ratio > 1:
+            return math.inf, -math.inf
+
+        # Widen by one to stay safe from floating point rounding, extra candidates are only scored
+        low = math.floor(length * ratio / (2 - ratio)) - 1
+        high = math.ceil(length * (2 - ratio) / ratio) + 1
+        return low, high
+
+
+def get_message_key(message: str) -> str:
+    """
+    Return the first `KEY_WORDS` words of the message that only have letters, such as the level and the start of the text.
+    Timestamps, ids and other values with digits or punctuation are skipped, they rarely repeat between lines.
+    """
+    return " ".join(itertools.islice((word for word in message.split() if word.isalpha()), KEY_WORDS))
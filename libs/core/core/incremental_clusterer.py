@@ -0,0 +1,171 @@
+import base64
+import json
+import os
+from array import array
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Protocol, Union
+
+from .fuzzy_index import FuzzyIndex
+from .log_entry import LogEntry, LogEntryRef, get_file_name, intern_file
+from .log_template_miner import TemplateMiner
+
+CHECKPOINT_VERSION = 2
+
+
+# Stateful clustering strategy, entries are added one at a time
+class ClusterIndex(Protocol):
+    def add(self, entry: LogEntry) -> LogEntry: ...
+
+    def get_entries(self) -> List[LogEntry]: ...
+
+    def get_state(self) -> Dict[str, Any]: ...
+
+    def set_state(self, entries: List[LogEntry], state: Dict[str, Any]) -> None: ...
+
+
+def create_template_miner(threshold: float) -> TemplateMiner:
+    return TemplateMiner(threshold / 100)
+
+
+# Strategy name -> factory taking the similarity threshold (0-100)
+CLUSTER_STRATEGIES: Dict[str, Callable[[float], ClusterIndex]] = {
+    "template": create_template_miner,
+    "fuzzy": FuzzyIndex,
+}
+
+
+# Online clusterer for lines that arrive over time, such as live pod logs.
+# Cluster state is kept across calls and can be checkpointed to disk and resumed.
+class IncrementalClusterer:
+    def __init__(self, threshold: float, strategy: str = "template") -> None:
+        """
+        :param threshold: Similarity threshold (0-100) for two entries to be clustered together.
+        :param strategy: Name of the clustering strategy, one of `CLUSTER_STRATEGIES`.
+        """
+        if strategy not in CLUSTER_STRATEGIES:
+            raise ValueError(f"Unknown clustering strategy '{strategy}'. Expected one of: {', '.join(CLUSTER_STRATEGIES)}")
+        self.threshold = threshold
+        self.strategy = strategy
+        self.index = CLUSTER_STRATEGIES[strategy](threshold)
+        self.new_clusters: List[LogEntry] = []
+        # File -> number of lines consumed, used to resume reading after a restart
+        self.positions: Dict[str, int] = {}
+
+    def add(self, line: str, ref: LogEntryRef) -> Optional[LogEntry]:
+        """
+        Add a log line. Returns the cluster representative the line was added to, or None for empty lines.
+        The consumed position of `ref.file` is advanced past `ref.line`.
+        """
+        self._advance(ref)
+        line = line.strip()
+        if not line:
+            return None
+
+        entry = LogEntry(message=line)
+        entry.add_ref(ref)
+        return self._add(entry)
+
+    def add_entry(self, entry: LogEntry) -> LogEntry:
+        """
+        Add an existing entry, such as a cluster from another clusterer, along with all of its references.
+        Returns the cluster representative the entry was merged into.
+        """
+        return self._add(entry)
+
+    def snapshot(self) -> List[LogEntry]:
+        """Return the current cluster representatives in the order they were created."""
+        return list(self.index.get_entries())
+
+    def drain_new_clusters(self) -> List[LogEntry]:
+        """Return the clusters created since the previous call."""
+        new_clusters = self.new_clusters
+        self.new_clusters = []
+        return new_clusters
+
+    def get_position(self, file: str) -> int:
+        """Return the number of lines of `file` consumed so far, lines before it can be skipped when resuming."""
+        return self.positions.get(file, 0)
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        Write a checkpoint of the cluster state to `path`. The file is replaced atomically so a
+        crash while saving leaves the previous checkpoint intact.
+
+        The references of all clusters are stored as base64 encoded columns (file, line and timestamp), the files
+        as indexes into the list of file names of the checkpoint.
+        """
+        entries = self.index.get_entries()
+        file_names: List[str] = []
+        checkpoint_ids: Dict[int, int] = {}
+        files = array("I")
+        lines = array("I")
+        timestamps = array("q")
+        for entry in entries:
+            references = entry.references
+            for file_id in references.file_stats:
+                if file_id not in checkpoint_ids:
+                    checkpoint_ids[file_id] = len(file_names)
+                    file_names.append(get_file_name(file_id))
+            files.extend(array("I", (checkpoint_ids[file_id] for file_id in references.files)))
+            lines.extend(references.lines)
+            timestamps.extend(references.timestamps)
+
+        checkpoint: Dict[str, Any] = {
+            "version": CHECKPOINT_VERSION,
+            "threshold": self.threshold,
+            "strategy": self.strategy,
+            "positions": self.positions,
+            "clusters": [{"message": entry.message, "references": len(entry.references)} for entry in entries],
+            "files": file_names,
+            "references": {name: base64.b64encode(column.tobytes()).decode() for name, column in [("files", files), ("lines", lines), ("timestamps", timestamps)]},
+            "index": self.index.get_state(),
+            # New clusters are always the most recently created ones
+            "new_clusters": len(self.new_clusters),
+        }
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "IncrementalClusterer":
+        """Restore a clusterer from a checkpoint written by `save`."""
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+
+        if checkpoint.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"Unsupported checkpoint version '{checkpoint.get('version')}' in '{path}'.")
+
+        clusterer = cls(checkpoint["threshold"], checkpoint["strategy"])
+        clusterer.positions = checkpoint["positions"]
+
+        file_ids = [intern_file(file_name) for file_name in checkpoint["files"]]
+        columns = {name: array(typecode) for name, typecode in [("files", "I"), ("lines", "I"), ("timestamps", "q")]}
+        for name, column in columns.items():
+            column.frombytes(base64.b64decode(checkpoint["references"][name]))
+        files = array("I", (file_ids[file] for file in columns["files"]))
+
+        entries: List[LogEntry] = []
+        start = 0
+        for cluster in checkpoint["clusters"]:
+            end = start + cluster["references"]
+            entry = LogEntry(message=cluster["message"])
+            entry.references.extend_columns(files[start:end], columns["lines"][start:end], columns["timestamps"][start:end])
+            entries.append(entry)
+            start = end
+        clusterer.index.set_state(entries, checkpoint["index"])
+
+        if checkpoint["new_clusters"]:
+            clusterer.new_clusters = clusterer.snapshot()[-checkpoint["new_clusters"] :]
+        return clusterer
+
+    def _add(self, entry: LogEntry) -> LogEntry:
+        cluster = self.index.add(entry)
+        if cluster is entry:
+            self.new_clusters.append(entry)
+        return cluster
+
+    def _advance(self, ref: LogEntryRef) -> None:
+        if ref.line + 1 > self.positions.get(ref.file, 0):
+            self.positions[ref.file] = ref.line + 1
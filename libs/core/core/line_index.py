@@ -0,0 +1,151 @@
+import hashlib
+import io
+import json
+import os
+import re
+from array import array
+from collections import namedtuple
+from pathlib import Path
+from typing import IO, Dict, List, Optional, Union
+
+from .filesystem import FileSystem, iter_text_lines
+from .llm_cache import DEFAULT_CACHE_DIR, EVICT_TO_FRACTION
+from .log_entry import LogEntry, get_file_name
+
+DEFAULT_SPILL_DIR = DEFAULT_CACHE_DIR / "lines"
+# Total size of the spill files, the least recently used are deleted past it
+DEFAULT_MAX_SPILL_BYTES = int(os.getenv("AETHER_MAX_SPILL_BYTES", str(2 * 1024**3)))
+# Bytes of a file scanned for line endings at a time
+SCAN_BLOCK_SIZE = 1 << 20
+# Lines before and after a referenced line returned by default
+CONTEXT_LINES = 5
+# Line endings recognized when the lines of a file are read as text, see `iter_text_lines`
+LINE_END = re.compile(rb"\r\n|\r|\n")
+
+# Lines of a log file, `start` is the 0 based number of the first line and `line` the number of the referenced line
+Snippet = namedtuple("Snippet", ["file", "start", "line", "lines"])
+
+
+def get_line_offsets(raw: IO[bytes], copy_to: Optional[IO[bytes]] = None) -> "array[int]":
+    """
+    Return the byte offset of the start of every line of a binary stream, followed by its length. The stream is
+    scanned in blocks, which are also written to `copy_to` if given.
+    """
+    offsets = array("Q", [0])
+    # Offset of the start of `block` in the stream
+    position = 0
+    carry = b""
+    while True:
+        data = raw.read(SCAN_BLOCK_SIZE)
+        if copy_to is not None:
+            copy_to.write(data)
+        block = carry + data if carry else data
+        # A \r at the end of a block may be the start of a \r\n, it is scanned with the next block
+        end = len(block) - 1 if data and block.endswith(b"\r") else len(block)
+        offsets.extend(position + match.end() for match in LINE_END.finditer(block, 0, end))
+        carry = block[end:]
+        position += end
+        if not data:
+            break
+    if offsets[-1] != position:
+        offsets.append(position)
+    return offsets
+
+
+# Byte offsets of the lines of the log files of a bundle, so that the lines around a reference are read with a single
+# seek instead of reading the file from its start. Offsets are only built for the files that are queried, by scanning
+# them once. Zip members can only be read from their start, so a member is decompressed once to a spill file in
+# `spill_dir` that is reused for as long as the member is unchanged. The least recently used spill files are deleted
+# when they outgrow `max_spill_bytes`.
+class LineIndex:
+    def __init__(self, fs: FileSystem, spill_dir: Union[str, Path, None] = None, max_spill_bytes: int = DEFAULT_MAX_SPILL_BYTES) -> None:
+        """
+        :param fs: The bundle.
+        :param spill_dir: Directory of the decompressed zip members, defaults to `lines` in the aether cache directory.
+        :param max_spill_bytes: Maximum total size of the spill files.
+        """
+        self.fs = fs
+        self.spill_dir = Path(spill_dir or DEFAULT_SPILL_DIR)
+        self.max_spill_bytes = max_spill_bytes
+        self.offsets: Dict[str, "array[int]"] = {}
+
+    def get_lines(self, file: str, start: int, end: int) -> List[str]:
+        """Return the lines of `file` from line `start` up to, but not including, line `end`."""
+        path = self._get_path(file)
+        offsets = self.offsets[file]
+        start = max(0, start)
+        end = min(end, len(offsets) - 1)
+        if start >= end:
+            return []
+        with open(path, "rb") as f:
+            f.seek(offsets[start])
+            data = f.read(offsets[end] - offsets[start])
+        return list(iter_text_lines(io.BytesIO(data), self.fs.errors))
+
+    def get_context(self, file: str, line: int, lines: int = CONTEXT_LINES) -> Snippet:
+        """Return the line `line` of `file` with up to `lines` lines before and after it."""
+        start = max(0, line - lines)
+        return Snippet(file, start, line, self.get_lines(file, start, line + lines + 1))
+
+    def get_entry_context(self, entry: LogEntry, count: int = 3, lines: int = CONTEXT_LINES) -> List[Snippet]:
+        """Return the context of the first occurrence of a log entry in up to `count` of the files it occurs in."""
+        snippets: List[Snippet] = []
+        seen = set()
+        for file_id, line in zip(entry.references.files, entry.references.lines):
+            if file_id in seen:
+                continue
+            seen.add(file_id)
+            snippets.append(self.get_context(get_file_name(file_id), line, lines))
+            if len(snippets) >= count:
+                break
+        return snippets
+
+    def _get_path(self, file: str) -> Path:
+        """Return the path of a file to read lines from, scanning it for its line offsets on first use."""
+        file = file.rstrip("/\\")
+        if not self.fs.zip_mode:
+            path = self.fs.path / file
+            if file not in self.offsets:
+                with open(path, "rb") as f:
+                    self.offsets[file] = get_line_offsets(f)
+            return path
+
+        # Spill files are named after the member and its key, a changed member is decompressed again
+        key = json.dumps([str(self.fs.path.resolve()), file, list(self.fs.get_file_key(file))])
+        path = self.spill_dir / f"{hashlib.sha256(key.encode()).hexdigest()[:32]}.log"
+        if path.exists():
+            # The modification time orders the spill files by last use
+            os.utime(path)
+            if file not in self.offsets:
+                with open(path, "rb") as f:
+                    self.offsets[file] = get_line_offsets(f)
+            return path
+
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with self.fs.zip_file.open(file, "r") as source, open(tmp_path, "wb") as target:
+            self.offsets[file] = get_line_offsets(source, target)
+        os.replace(tmp_path, path)
+        self._evict(path)
+        return path
+
+    def _evict(self, keep: Path) -> None:
+        """Delete the least recently used spill files, other than `keep`, if the spill files are larger than the maximum."""
+        spills = []
+        for path in self.spill_dir.glob("*.log"):
+            try:
+                spills.append((path.stat(), path))
+            except FileNotFoundError:  # deleted by another process
+                continue
+        total = sum(stat.st_size for stat, _ in spills)
+        if total <= self.max_spill_bytes:
+            return
+
+        target = self.max_spill_bytes * EVICT_TO_FRACTION
+        for stat, path in sorted(spills, key=lambda spill: spill[0].st_mtime):
+            if total <= target:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= stat.st_size
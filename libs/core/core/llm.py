@@ -1,25 +1,136 @@
+import asyncio
+import atexit
 import json
 import logging
 import os
-from typing import List, Any, Optional, Dict
-from openai import AzureOpenAI, Stream
+import queue
+import random
+import threading
+import time
+import weakref
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Awaitable, Callable, Coroutine, Iterator, List, Any, Optional, Dict, Tuple, TypeVar, Union
+from .metrics import Stage, emit, stage
+from .prompt import get_prompt
+from .rate_limiter import RateLimiter
 from .util import extract_first_json_block
 
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "")
-DEPLOYMENT_NAME = os.getenv("AZURE_DEPLOYMENT_NAME", "")
+# The openai SDK is only imported when the first client is created, see `get_async_client`
+if TYPE_CHECKING:
+    from openai import AsyncAzureOpenAI
+    from openai.types.chat import ChatCompletion
+
+API_VERSION = "2024-05-01-preview"
+# Service quotas for the deployment, 0 disables client side rate limiting
+TOKENS_PER_MINUTE = int(os.getenv("AZURE_OPENAI_TOKENS_PER_MINUTE", "0"))
+REQUESTS_PER_MINUTE = int(os.getenv("AZURE_OPENAI_REQUESTS_PER_MINUTE", "0"))
+# Estimated size of a single prompt, large inputs are split into chunks that fit
+PROMPT_TOKEN_BUDGET = int(os.getenv("AZURE_OPENAI_PROMPT_TOKEN_BUDGET", "32000"))
+# Rough number of characters per token for English and JSON
+CHARS_PER_TOKEN = 4
+# Retries of throttled (429) and failed (5xx, connection) async requests
+LLM_MAX_RETRIES = 5
+LLM_RETRY_BASE_DELAY = 1.0
+LLM_RETRY_MAX_DELAY = 60.0
+# Estimated tokens of the chat turns sent after the start of a conversation, older turns are summarized past it
+CHAT_TOKEN_BUDGET = int(os.getenv("AZURE_OPENAI_CHAT_TOKEN_BUDGET", "8000"))
+# Turns are summarized until the rest fit in this fraction of the budget, so it doesn't happen on every turn
+CHAT_COMPACT_TO_FRACTION = 0.5
+# Maximum tokens of the notes that replace the summarized turns
+CHAT_NOTES_MAX_TOKENS = 1024
+CHAT_COMPACT_PROMPT = "compact_chat.md"
 SYSTEM_PROMPT = "You are an expert software support agent for azure iot operations. You are helping a customer troubleshoot an issue with their kubernetes pod logs."
 
-headers = {
-    "Content-Type": "application/json",
-    "api-key": AZURE_OPENAI_API_KEY,
-}
+rate_limiter = RateLimiter(TOKENS_PER_MINUTE, REQUESTS_PER_MINUTE)
+
+# Async clients by event loop, see `get_async_client`. Requests share the client of the loop so that HTTP connections are reused
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncAzureOpenAI]" = weakref.WeakKeyDictionary()
+_client_lock = threading.Lock()
+# Event loop that runs the requests of the sync entry points on a background thread, see `run_async`
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+T = TypeVar("T")
+
+
+def get_api_key() -> str:
+    api_key = os.getenv("AZURE_OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("'AZURE_OPENAI_API_KEY' env var is not set. Unable to make requests to Azure OpenAI.")
+    return api_key
+
+
+def get_deployment_name() -> str:
+    return os.getenv("AZURE_DEPLOYMENT_NAME", "")
+
+
+def get_async_client() -> "AsyncAzureOpenAI":
+    """
+    Return the async client of the running event loop. It is created from the environment on first use, importing
+    `core` doesn't import the openai SDK or need the Azure env vars to be set. The connections of a client can only be
+    used on the loop that opened them, so each loop gets its own client. Requests sent with `run_async` all run on the
+    same loop and share its client for the life of the process. Retries are handled by `send_with_retries` so they
+    go through the rate limiter.
+    """
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        async_client = _async_clients.get(loop)
+        if async_client is None:
+            from openai import AsyncAzureOpenAI
+
+            async_client = AsyncAzureOpenAI(azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT", ""), api_key=get_api_key(), api_version=API_VERSION, max_retries=0)
+            _async_clients[loop] = async_client
+        return async_client
 
-client = AzureOpenAI(
-    azure_endpoint=ENDPOINT,
-    api_key=AZURE_OPENAI_API_KEY,
-    api_version="2024-05-01-preview",
-)
+
+async def close_async_client() -> None:
+    """Close the async client of the running event loop, if it has one, such as before an event loop of the caller ends."""
+    with _client_lock:
+        async_client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if async_client is not None:
+        await async_client.close()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop of `run_async`, it is started on a daemon thread on first use."""
+    global _loop
+    with _client_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+            atexit.register(stop_event_loop)
+        return _loop
+
+
+def stop_event_loop() -> None:
+    """Close the client of the event loop of `run_async` and stop the loop, it is called at exit."""
+    global _loop
+    with _client_lock:
+        loop, _loop = _loop, None
+    if loop is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(close_async_client(), loop).result(timeout=5)
+    except Exception as e:
+        logging.debug(f"Failed to close the async client: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+
+
+def run_async(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Run a coroutine on the shared event loop and wait for its result, see `get_event_loop`. Every call uses the same
+    async client so HTTP connections are reused across calls, such as the filter, the summary and each chat turn.
+    The coroutine runs in a copy of the caller's context, so it belongs to the caller's metrics stage.
+    Code that already runs in an event loop awaits the coroutine instead, this raises a RuntimeError there.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        name = getattr(coroutine, "__qualname__", "The coroutine")
+        coroutine.close()
+        raise RuntimeError(f"{name} can't be run synchronously from a running event loop, await it instead.")
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
 
 
 def query_llm(
@@ -33,47 +144,381 @@ def query_llm(
     If `chat` is provided, it's assumed to be the entire list of messages (the conversation).
 
     This method now returns the updated conversation list (messages), with the assistant's
-    response appended at the end.
+    response appended at the end. The request is sent by `query_llm_async` on the shared event loop, see `run_async`,
+    so it goes through the same rate limiter and retries as the async requests.
     """
-    if not AZURE_OPENAI_API_KEY:
-        raise ValueError("'AZURE_OPENAI_API_KEY' env var is not set. Unable to make requests to Azure OpenAI.")
+    return run_async(query_llm_async(prompt, system=system, max_tokens=max_tokens, chat=chat))
+
+
+async def query_llm_async(
+    prompt: str,
+    system: str = SYSTEM_PROMPT,
+    max_tokens: int = 1024,
+    chat: Optional[List[Dict[str, Any]]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Async version of `query_llm`. Requests wait for the rate limiter and are retried with
+    exponential backoff when throttled (429) or on server and connection errors, see `send_with_retries`.
+    """
+    async_client = get_async_client()
+    messages = create_messages(prompt, system, chat)
+
+    async def send() -> Tuple["ChatCompletion", float]:
+        start = time.perf_counter()
+        completion: "ChatCompletion" = await async_client.chat.completions.create(
+            model=get_deployment_name(),
+            messages=messages,  # type: ignore
+            max_tokens=max_tokens,
+            temperature=0.7,
+            top_p=0.95,
+            frequency_penalty=0,
+            presence_penalty=0,
+            stop=None,
+            stream=False,
+        )
+        return completion, time.perf_counter() - start
+
+    # Quotas count the prompt and the requested completion tokens
+    (completion, latency), attempts = await send_with_retries(send, estimate_tokens(json.dumps(messages)) + max_tokens)
+    record_completion(completion, latency, attempts=attempts)
+    messages.append({"role": "assistant", "content": str(completion.choices[0].message.content)})
+    return messages
+
+
+async def send_with_retries(send: Callable[[], Awaitable[T]], request_tokens: int, can_retry: Callable[[], bool] = lambda: True) -> Tuple[T, int]:
+    """
+    Call `send` once the rate limiter has room for the request, retrying it with exponential backoff when throttled
+    (429) or on server and connection errors. Returns the result of `send` and the number of attempts.
+
+    :param send: Sends the request, it is called again for every attempt.
+    :param request_tokens: Estimated tokens of the request, the prompt and the requested completion tokens.
+    :param can_retry: Returns False once a failed request can't be sent again, such as after part of a streamed
+        response was passed on.
+    """
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+
+    attempt = 0
+    while True:
+        await rate_limiter.acquire(request_tokens)
+        try:
+            return await send(), attempt + 1
+        except (RateLimitError, InternalServerError, APIConnectionError) as e:
+            if attempt >= LLM_MAX_RETRIES or not can_retry():
+                raise
+            delay = get_retry_delay(e, attempt)
+            logging.warning(f"LLM request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def stream_llm(
+    prompt: str,
+    system: str = SYSTEM_PROMPT,
+    max_tokens: int = 1024,
+    chat: Optional[List[Dict[str, Any]]] = None,
+) -> "LLMStream":
+    """
+    Streaming version of `query_llm`. The request starts right away on a background thread, iterate the returned
+    stream for the response as it arrives. The conversation with the response appended is `LLMStream.messages`.
+    """
+    return LLMStream(lambda: create_messages(prompt, system, chat), max_tokens)
+
+
+# Chat that keeps the size of its prompts bounded. The start of the conversation, such as the analysis of the logs,
+# is sent unchanged with every turn so that the service can cache it as a prompt prefix. The messages after it are
+# kept within a token budget, when they outgrow it the oldest turns are summarized into notes that replace them.
+class ChatSession:
+    def __init__(self, messages: List[Dict[str, Any]], token_budget: int = CHAT_TOKEN_BUDGET, max_tokens: int = 1024) -> None:
+        """
+        :param messages: The start of the conversation, see `LLMStream.messages`.
+        :param token_budget: Estimated tokens of the messages after the start of the conversation, including the notes.
+        :param max_tokens: Maximum tokens of a response.
+        """
+        self.prefix = list(messages)
+        self.prefix_tokens = sum(get_message_tokens(message) for message in self.prefix)
+        self.token_budget = token_budget
+        self.max_tokens = max_tokens
+        self.notes = ""
+        self.notes_tokens = 0
+        # Messages after the start of the conversation and their estimated tokens
+        self.history: List[Dict[str, Any]] = []
+        self.history_tokens: List[int] = []
+        self.turns = 0
+        self.compacted_messages = 0
+
+    def add_message(self, content: str, role: str = "user") -> None:
+        """Add a message to the conversation, such as log lines for the next question to refer to."""
+        message = {"role": role, "content": content}
+        self.history.append(message)
+        self.history_tokens.append(get_message_tokens(message))
+
+    def send(self, prompt: str) -> "LLMStream":
+        """
+        Send a message and return the stream of the response, see `LLMStream`. If the conversation outgrew the budget
+        the oldest turns are summarized first, on the background thread of the stream. If the request fails the message
+        is removed from the conversation, so that it is not sent again with the next one.
+        """
+        self.add_message(prompt)
+        message = self.history[-1]
+        self.turns += 1
+        turn = self.turns
+        return LLMStream(
+            self._get_turn_messages,
+            self.max_tokens,
+            stage("chat"),
+            on_complete=lambda stream: self._add_response(turn, stream),
+            on_error=lambda stream: self._remove_message(message),
+        )
+
+    def get_messages(self) -> List[Dict[str, Any]]:
+        """Return the messages sent with the next turn."""
+        notes = [{"role": "user", "content": f"Notes on the earlier part of this conversation:\n{self.notes}"}] if self.notes else []
+        return self.prefix + notes + self.history
+
+    def get_history_tokens(self) -> int:
+        return self.notes_tokens + sum(self.history_tokens)
+
+    def compact(self) -> None:
+        """
+        Summarize the oldest turns into notes if the messages after the start of the conversation don't fit in the
+        budget. Whole turns are summarized until the rest fit in a fraction of the budget, the messages of the turn that
+        is not answered yet are kept.
+        If the summary fails the turns are dropped and the earlier notes are kept.
+        """
+        from .token_budget import truncate_text
+
+        if self.get_history_tokens() <= self.token_budget:
+            return
+        target = self.token_budget * CHAT_COMPACT_TO_FRACTION - CHAT_NOTES_MAX_TOKENS
+        # Messages added since the last response, such as attached log lines, belong to the new question
+        answered = max((i + 1 for i, message in enumerate(self.history) if message["role"] == "assistant"), default=0)
+        count = 0
+        remaining = sum(self.history_tokens)
+        while count < answered and (remaining > target or self.history[count]["role"] != "user"):
+            remaining -= self.history_tokens[count]
+            count += 1
+        if count == 0:
+            return
+
+        with stage("compact_chat") as compact_stage:
+            parts = [f"Earlier notes:\n{self.notes}"] if self.notes else []
+            parts.extend(f"{message['role']}: {message['content']}" for message in self.history[:count])
+            # The summary of a few huge messages still has to fit in a prompt
+            text = truncate_text("\n\n".join(parts), PROMPT_TOKEN_BUDGET - CHAT_NOTES_MAX_TOKENS)
+            try:
+                # Rate limited and retried like the other requests
+                chat = run_async(query_llm_async(get_prompt(CHAT_COMPACT_PROMPT, text), max_tokens=CHAT_NOTES_MAX_TOKENS))
+                self.notes = get_last_message_content(chat)
+                self.notes_tokens = estimate_tokens(self.notes)
+            except Exception as e:
+                logging.warning(f"Failed to summarize the earlier chat turns, they are dropped: {e}")
+            compact_stage.set(messages=count, tokens=sum(self.history_tokens[:count]), notes_tokens=self.notes_tokens)
+
+        del self.history[:count]
+        del self.history_tokens[:count]
+        self.compacted_messages += count
+
+    def _get_turn_messages(self) -> List[Dict[str, Any]]:
+        self.compact()
+        return self.get_messages()
+
+    def _remove_message(self, message: Dict[str, Any]) -> None:
+        for i, history_message in enumerate(self.history):
+            if history_message is message:
+                del self.history[i]
+                del self.history_tokens[i]
+                return
+
+    def _add_response(self, turn: int, stream: "LLMStream") -> None:
+        # Estimated tokens of the prompt that was sent, split between the start of the conversation and the rest
+        emit(
+            "chat_turn",
+            turn=turn,
+            latency_seconds=stream.latency_seconds,
+            time_to_first_token_seconds=stream.time_to_first_token,
+            prompt_tokens=stream.usage.get("prompt_tokens", 0),
+            completion_tokens=stream.usage.get("completion_tokens", 0),
+            prefix_tokens=self.prefix_tokens,
+            history_tokens=self.get_history_tokens(),
+            compacted_messages=self.compacted_messages,
+        )
+        self.history.append({"role": "assistant", "content": stream.content})
+        self.history_tokens.append(stream.usage.get("completion_tokens") or estimate_tokens(stream.content))
+
+
+# Streamed chat completion. A background thread prepares the messages from the moment the stream is created and sends
+# the request on the shared event loop of `run_async`, so the caller can do other work until the first token arrives. Iterating yields the deltas of the response content, once
+# the iteration ends `messages` includes the response and `usage` holds its token counts. Like `query_llm_async`
+# the request waits for the rate limiter, and it is retried as long as no part of the response was received.
+class LLMStream:
+    def __init__(
+        self,
+        get_messages: Callable[[], List[Dict[str, Any]]],
+        max_tokens: int = 1024,
+        metrics_stage: Optional[Stage] = None,
+        on_complete: Optional[Callable[["LLMStream"], None]] = None,
+        on_error: Optional[Callable[["LLMStream"], None]] = None,
+    ) -> None:
+        """
+        :param get_messages: Returns the conversation to send. It is called on the background thread, so it can do slow
+            work such as summarizing the parts of a large input first.
+        :param max_tokens: Maximum tokens of the response.
+        :param metrics_stage: Stage measured around `get_messages` and the request, see `core.metrics.stage`.
+        :param on_complete: Called on the background thread with the stream once the response is complete, before the
+            iteration of the stream ends.
+        :param on_error: Called on the background thread with the stream if the request fails, before the iteration
+            of the stream raises the error.
+        """
+        # Fail right away rather than on the first iteration
+        get_api_key()
+        self.max_tokens = max_tokens
+        self.messages: List[Dict[str, Any]] = []
+        self.content = ""
+        self.usage: Dict[str, int] = {}
+        self.time_to_first_token: Optional[float] = None
+        self.latency_seconds = 0.0
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        # Deltas of the response, then None when it is complete or the error that ended it
+        self._deltas: "queue.Queue[Union[str, BaseException, None]]" = queue.Queue()
+        self._on_complete = on_complete
+        self._on_error = on_error
+        self._thread = threading.Thread(target=self._run, args=(get_messages, metrics_stage), daemon=True)
+        self._thread.start()
+
+    def __iter__(self) -> Iterator[str]:
+        while not self.finished:
+            item = self._deltas.get()
+            if isinstance(item, str):
+                yield item
+                continue
+            self.finished = True
+            self.error = item
+        if self.error:
+            raise self.error
+
+    def get_messages(self) -> List[Dict[str, Any]]:
+        """Wait for the rest of the response and return the conversation."""
+        for _ in self:
+            pass
+        return self.messages
+
+    def _run(self, get_messages: Callable[[], List[Dict[str, Any]]], metrics_stage: Optional[Stage]) -> None:
+        try:
+            with metrics_stage or nullcontext():
+                # The request runs on the shared event loop, the thread prepares the messages and waits for it
+                run_async(self._stream(get_messages()))
+                if self._on_complete:
+                    self._on_complete(self)
+        except BaseException as e:
+            self.error = e
+            if self._on_error:
+                self._on_error(self)
+            self._deltas.put(e)
+            return
+        self._deltas.put(None)
+
+    async def _stream(self, messages: List[Dict[str, Any]]) -> None:
+        from openai import AsyncStream
+
+        async_client = get_async_client()
+        parts: List[str] = []
+
+        async def send() -> float:
+            start = time.perf_counter()
+            stream = await async_client.chat.completions.create(
+                model=get_deployment_name(),
+                messages=messages,  # type: ignore
+                max_tokens=self.max_tokens,
+                temperature=0.7,
+                top_p=0.95,
+                frequency_penalty=0,
+                presence_penalty=0,
+                stop=None,
+                stream=True,
+            )
+            if not isinstance(stream, AsyncStream):
+                raise ValueError("Expected AsyncStream[ChatCompletionChunk], got ChatCompletion")
+
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    self.usage = {"prompt_tokens": chunk.usage.prompt_tokens, "completion_tokens": chunk.usage.completion_tokens}
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if self.time_to_first_token is None:
+                        self.time_to_first_token = time.perf_counter() - start
+                    parts.append(delta)
+                    self._deltas.put(delta)
+            return start
+
+        # Once part of the response was passed on, a failed request can't be sent again
+        start, attempts = await send_with_retries(send, estimate_tokens(json.dumps(messages)) + self.max_tokens, can_retry=lambda: not parts)
+        self.content = "".join(parts)
+
+        # Services that don't report the usage of streamed responses get an estimate
+        if not self.usage:
+            self.usage = {"prompt_tokens": estimate_tokens(json.dumps(messages)), "completion_tokens": estimate_tokens(self.content)}
+        self.latency_seconds = time.perf_counter() - start
+        emit(
+            "llm_call",
+            latency_seconds=self.latency_seconds,
+            time_to_first_token_seconds=self.time_to_first_token,
+            attempts=attempts,
+            **self.usage,
+        )
+        messages.append({"role": "assistant", "content": self.content})
+        self.messages = messages
+
 
+def record_completion(completion: "ChatCompletion", latency: float, attempts: int) -> None:
+    """Log the token usage of a completion and emit it as a metrics event along with the latency of the request."""
+    prompt_tokens = completion_tokens = 0
+    if completion.usage is not None:
+        prompt_tokens = completion.usage.prompt_tokens
+        completion_tokens = completion.usage.completion_tokens
+        logging.debug(f"Total tokens: {completion.usage.total_tokens} " f"Prompt tokens: {prompt_tokens} " f"Completion tokens: {completion_tokens}")
+    emit("llm_call", latency_seconds=latency, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, attempts=attempts)
+
+
+def create_messages(prompt: str, system: str, chat: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
     # If we're continuing a conversation, just append the new user message
     if chat is not None:
         chat.append({"role": "user", "content": prompt})
-        messages = chat
-    else:
-        # Otherwise, start a brand new conversation
-        messages = [
-            {"role": "system", "content": [{"type": "text", "text": system}]},
-            {"role": "user", "content": prompt},
-        ]
-
-    completion = client.chat.completions.create(
-        model=DEPLOYMENT_NAME,  # Ensure DEPLOYMENT_NAME is a valid str
-        messages=messages,  # type: ignore
-        max_tokens=max_tokens,
-        temperature=0.7,
-        top_p=0.95,
-        frequency_penalty=0,
-        presence_penalty=0,
-        stop=None,
-        stream=False,
-    )
-
-    if hasattr(completion, "usage") and completion.usage is not None:
-        logging.debug(f"Total tokens: {completion.usage.total_tokens} " f"Prompt tokens: {completion.usage.prompt_tokens} " f"Completion tokens: {completion.usage.completion_tokens}")
-
-    # Get the assistant's response
-    if isinstance(completion, Stream):
-        raise ValueError("Expected ChatCompletion, got Stream[ChatCompletionChunk]")
-    assistant_response = str(completion.choices[0].message.content)
-
-    # Append the assistant's response to the conversation
-    messages.append({"role": "assistant", "content": assistant_response})
-
-    # Return the entire updated conversation
-    return messages
+        return chat
+
+    # Otherwise, start a brand new conversation
+    return [
+        {"role": "system", "content": [{"type": "text", "text": system}]},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def get_retry_delay(error: Exception, attempt: int) -> float:
+    """Return the delay before retrying, the service's retry-after header if given, otherwise exponential backoff with jitter."""
+    from openai import APIStatusError
+
+    if isinstance(error, APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), LLM_RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    delay: float = min(LLM_RETRY_BASE_DELAY * 2**attempt, LLM_RETRY_MAX_DELAY)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text, about four characters per token for English and JSON."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def get_message_tokens(message: Dict[str, Any]) -> int:
+    """Estimated tokens of a chat message, its content is either a string or a list of text parts."""
+    content = message.get("content", "")
+    if isinstance(content, list):
+        content = "".join(str(part.get("text", "")) for part in content)
+    return estimate_tokens(str(content))
 
 
 def get_last_message_content(chat: List[Dict[str, Any]]) -> str:
@@ -106,3 +551,22 @@ def query_json_llm(
     except Exception as e:
         logging.error(f"Failed to parse JSON from response! {e}\n{last_message}")
         return None  # Ensure a return value
+
+
+async def query_json_llm_async(
+    prompt: str,
+    system: str = SYSTEM_PROMPT,
+    max_tokens: int = 4096,
+    chat: Optional[List[Dict[str, Any]]] = None,
+) -> Any:
+    """
+    Async version of `query_json_llm`.
+    """
+    updated_chat = await query_llm_async(prompt, system=system, max_tokens=max_tokens, chat=chat)
+    last_message = get_last_message_content(updated_chat)
+    try:
+        result_json = extract_first_json_block(last_message)
+        return json.loads(result_json)
+    except Exception as e:
+        logging.error(f"Failed to parse JSON from response! {e}\n{last_message}")
+        return None
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple, Union
+
+DEFAULT_CACHE_DIR = Path(os.getenv("AETHER_CACHE_DIR", Path.home() / ".cache" / "aether"))
+DEFAULT_MAX_ENTRIES = 1_000_000
+
+# When the cache is full, evict down to this fraction of the maximum so eviction doesn't run on every write
+EVICT_TO_FRACTION = 0.9
+
+# SQLite limits the number of query parameters
+QUERY_BATCH_SIZE = 500
+
+
+def get_message_hash(message: str) -> str:
+    return hashlib.sha256(message.encode()).hexdigest()
+
+
+# On disk cache of LLM failure/non-failure verdicts for log messages, keyed by the message hash,
+# the hash of the prompt used to classify it, and the model deployment.
+class VerdictCache:
+    def __init__(self, path: Union[str, Path, None] = None, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        """
+        :param path: SQLite database file, defaults to `verdicts.sqlite` in the aether cache directory.
+        :param max_entries: Maximum number of verdicts kept, the least recently used are evicted first.
+        """
+        self.path = Path(path) if path else DEFAULT_CACHE_DIR / "verdicts.sqlite"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # The filter uses the cache on the event loop of `core.llm.run_async` while its caller waits, so the
+        # connection is used by one thread at a time
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS verdicts (
+                message_hash TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                deployment TEXT NOT NULL,
+                message TEXT NOT NULL,
+                failure INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (message_hash, prompt_hash, deployment)
+            )
+            """
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)")
+        self.connection.commit()
+
+    def get_verdicts(self, messages: Iterable[str], prompt_hash: str, deployment: str) -> Dict[str, bool]:
+        """
+        Return the cached verdicts (True for failures) of the messages that have one.
+        """
+        hashes = {get_message_hash(message): message for message in messages}
+        verdicts: Dict[str, bool] = {}
+        hash_list = list(hashes)
+        for i in range(0, len(hash_list), QUERY_BATCH_SIZE):
+            batch = hash_list[i : i + QUERY_BATCH_SIZE]
+            rows = self.connection.execute(
+                f"SELECT message_hash, failure FROM verdicts WHERE prompt_hash = ? AND deployment = ? AND message_hash IN ({', '.join('?' * len(batch))})",
+                [prompt_hash, deployment, *batch],
+            )
+            for message_hash, failure in rows:
+                verdicts[hashes[message_hash]] = bool(failure)
+
+        now = time.time()
+        self.connection.executemany(
+            "UPDATE verdicts SET last_used = ? WHERE message_hash = ? AND prompt_hash = ? AND deployment = ?",
+            [(now, get_message_hash(message), prompt_hash, deployment) for message in verdicts],
+        )
+        self.connection.commit()
+
+        self.hits += len(verdicts)
+        self.misses += len(hashes) - len(verdicts)
+        return verdicts
+
+    def put_verdicts(self, verdicts: Dict[str, bool], prompt_hash: str, deployment: str) -> None:
+        """Store verdicts (True for failures) by message, evicting the least recently used if the cache is full."""
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO verdicts (message_hash, prompt_hash, deployment, message, failure, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+            [(get_message_hash(message), prompt_hash, deployment, message, int(failure), now) for message, failure in verdicts.items()],
+        )
+        self._evict()
+        self.connection.commit()
+
+    def get_recent_verdicts(self, prompt_hash: str, deployment: str, limit: int) -> List[Tuple[str, bool]]:
+        """Return up to `limit` of the most recently used messages and their verdicts."""
+        rows = self.connection.execute(
+            "SELECT message, failure FROM verdicts WHERE prompt_hash = ? AND deployment = ? ORDER BY last_used DESC LIMIT ?",
+            (prompt_hash, deployment, limit),
+        )
+        return [(message, bool(failure)) for message, failure in rows]
+
+    def get_stats(self) -> Dict[str, int]:
+        (entries,) = self.connection.execute("SELECT COUNT(*) FROM verdicts").fetchone()
+        return {"entries": entries, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _evict(self) -> None:
+        (entries,) = self.connection.execute("SELECT COUNT(*) FROM verdicts").fetchone()
+        if entries <= self.max_entries:
+            return
+
+        evict_count = entries - int(self.max_entries * EVICT_TO_FRACTION)
+        self.connection.execute("DELETE FROM verdicts WHERE rowid IN (SELECT rowid FROM verdicts ORDER BY last_used LIMIT ?)", (evict_count,))
+        self.evictions += evict_count
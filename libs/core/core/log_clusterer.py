@@ -1,84 +1,272 @@
-import re
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from .filesystem import FileSystem
-from .log_entry import LogEntry, LogEntryRef
-from rapidfuzz import fuzz
+from .bundle_index import BundleIndex
+from .filesystem import READ_THREADS, FileSystem
+from .fuzzy_index import FuzzyIndex
+from .incremental_clusterer import CLUSTER_STRATEGIES, IncrementalClusterer
+from .log_entry import LogEntry, LogEntryRef, intern_file
+from .log_selection import LogSelection
+from .log_template_miner import mask_message
+from .metrics import emit, stage
+from .timestamp import TimestampParser, parse_timestamp
+
+# Compact per-file cluster sent back from worker processes: (message, line numbers, epoch timestamps).
+# All references point to the file that was clustered so the file name is not repeated.
+CompactCluster = Tuple[str, "array[int]", "array[int]"]
 
 
 # Entry point for the log clustering process
 class LogClusterer:
-    def __init__(self, threshold: float):
+    def __init__(self, threshold: float, strategy: str = "template", workers: int = 1, read_threads: int = READ_THREADS):
+        """
+        :param threshold: Similarity threshold (0-100) for two entries to be clustered together.
+        :param strategy: Name of the clustering strategy, one of `CLUSTER_STRATEGIES`.
+        :param workers: Number of processes used to read and cluster files, 1 clusters in process.
+        :param read_threads: Number of threads reading files ahead of the clustering when clustering in process.
+        """
+        if strategy not in CLUSTER_STRATEGIES:
+            raise ValueError(f"Unknown clustering strategy '{strategy}'. Expected one of: {', '.join(CLUSTER_STRATEGIES)}")
+        if workers < 1:
+            raise ValueError("workers must be at least 1.")
         self.threshold = threshold
+        self.strategy = strategy
+        self.workers = workers
+        self.read_threads = read_threads
+
+    def cluster(self, entries: Iterable[LogEntry]) -> List[LogEntry]:
+        clusterer = IncrementalClusterer(self.threshold, self.strategy)
+        for entry in entries:
+            clusterer.add_entry(entry)
+        return clusterer.snapshot()
+
+    def cluster_file(self, fs: FileSystem, file: str, selection: Optional[LogSelection] = None) -> List[LogEntry]:
+        """Stream and cluster the lines of a single file, without holding all of them in memory."""
+        clusters, file_metrics = self.cluster_file_with_metrics(fs, file, selection)
+        emit("file", **file_metrics)
+        return clusters
+
+    def cluster_file_with_metrics(self, fs: FileSystem, file: str, selection: Optional[LogSelection] = None) -> Tuple[List[LogEntry], Dict[str, Any]]:
+        """
+        Cluster a single file, also returning the line count and the time spent reading, parsing timestamps and clustering.
+        The metrics are returned instead of emitted so worker processes can send them back to the parent.
+
+        :param selection: Lines outside of the time window of the selection are skipped.
+        """
+        return self.cluster_lines_with_metrics(file, fs.iter_lines(file), selection, fs.get_file_time(file))
 
-    def cluster(self, entries: List[LogEntry]) -> List[LogEntry]:
-        return fuzzy_match_entries(entries, self.threshold)
+    def cluster_lines_with_metrics(self, file: str, file_lines: Iterable[str], selection: Optional[LogSelection] = None, reference_time: Optional[datetime] = None) -> Tuple[List[LogEntry], Dict[str, Any]]:
+        """
+        Cluster the lines of `file`, see `cluster_file_with_metrics`.
 
-    def cluster_files(self, fs: FileSystem, namespace: str) -> List[LogEntry]:
-        cross_file_entries = []
+        :param reference_time: Modification time of the file, timestamps without a year are put before it.
+        """
+        clusterer = IncrementalClusterer(self.threshold, self.strategy)
+        timestamp_parser = TimestampParser(reference_time=reference_time)
+        allow_timestamp = selection.allow_timestamp if selection and selection.has_time_window() else None
+        clock = time.perf_counter
+        read_seconds = parse_seconds = 0.0
+        lines = skipped_lines = 0
+        start = read_start = clock()
+        for i, line in enumerate(file_lines):
+            parse_start = clock()
+            timestamp = timestamp_parser.parse(line)
+            cluster_start = clock()
+            # Skipped lines keep their line numbers so the references of the others still point to the right lines
+            if allow_timestamp is None or allow_timestamp(timestamp):
+                clusterer.add(line, LogEntryRef(file, i, timestamp))
+            else:
+                skipped_lines += 1
+            read_seconds += parse_start - read_start
+            parse_seconds += cluster_start - parse_start
+            read_start = clock()
+            lines += 1
+        clusters = clusterer.snapshot()
+
+        wall_seconds = clock() - start
+        file_metrics = {
+            "file": file,
+            "lines": lines,
+            "skipped_lines": skipped_lines,
+            "clusters": len(clusters),
+            "read_seconds": read_seconds,
+            "parse_seconds": parse_seconds,
+            "cluster_seconds": wall_seconds - read_seconds - parse_seconds,
+            "wall_seconds": wall_seconds,
+        }
+        return clusters, file_metrics
+
+    def cluster_files(self, fs: FileSystem, selection: Union[str, LogSelection], index: Optional[BundleIndex] = None) -> List[LogEntry]:
+        """
+        Cluster the selected log files within each file, then across files. The cross file pass first merges the
+        clusters with identical messages, see `merge_identical_clusters`, the result does not depend on the file order.
+
+        :param fs: The bundle.
+        :param selection: Files and time window to cluster, or the name of a single namespace to cluster all of its files.
+        :param index: Index of the per-file clusters of the bundle, built for the same time window as the selection.
+            Files that are unchanged since they were indexed are not read again, the others are clustered and added to
+            the index, files that are no longer in the bundle are removed from it. The caller saves the index.
+        """
+        if isinstance(selection, str):
+            selection = LogSelection([selection])
+        if index and index.config["time_window"] != selection.get_time_window():
+            raise ValueError("The bundle index was built for another time window than the selection.")
+        bundle_files = fs.list_files()
+        files = [file for file in bundle_files if selection.allow_file(file)]
+        if index:
+            # Files removed from the bundle are dropped, files outside the selection are kept for later runs
+            index.retain(bundle_files)
+        file_entries: Dict[str, List[LogEntry]] = {}
 
         # Cluster within each file
-        for file in fs.list_files():
-            if allow_log_path(file, namespace):
-                log_lines = fs.read_file(file)
-                file_entries = get_log_entries(log_lines, file)
-                file_clustered_entries = self.cluster(file_entries)
-                cross_file_entries.extend(file_clustered_entries)
+        with stage("file_cluster") as file_stage:
+            file_keys = {file: fs.get_file_key(file) for file in files} if index else {}
+            for file in files:
+                indexed = index.get(file, file_keys[file]) if index else None
+                if indexed is not None:
+                    file_entries[file] = expand_compact_clusters(indexed, file)
+            pending = [file for file in files if file not in file_entries]
+
+            lines = 0
+            if self.workers > 1 and len(pending) > 1:
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(pending))) as executor:
+                    results = executor.map(cluster_file_compact, [str(fs.path)] * len(pending), pending, [self.threshold] * len(pending), [self.strategy] * len(pending), [selection] * len(pending))
+                    for file, (compact_clusters, file_metrics) in zip(pending, results):
+                        emit("file", **file_metrics)
+                        lines += file_metrics["lines"]
+                        file_entries[file] = expand_compact_clusters(compact_clusters, file)
+                        if index:
+                            index.put(file, file_keys[file], compact_clusters)
+            else:
+                # Later files are read on background threads while a file is clustered, waiting for them is read time
+                for file, file_lines in fs.iter_files(pending, self.read_threads):
+                    clusters, file_metrics = self.cluster_lines_with_metrics(file, file_lines, selection, fs.get_file_time(file))
+                    emit("file", **file_metrics)
+                    lines += file_metrics["lines"]
+                    file_entries[file] = clusters
+                    if index:
+                        index.put(file, file_keys[file], to_compact_clusters(clusters))
+
+            file_stage.set(files=len(files), indexed_files=len(files) - len(pending), lines=lines, clusters=sum(len(entries) for entries in file_entries.values()), workers=self.workers)
 
         # Cluster across all files
-        return self.cluster(cross_file_entries)
+        with stage("cross_file_cluster") as cross_file_stage:
+            # The template strategy treats lines that only differ by masked values as the same line
+            merged = merge_identical_clusters(file_entries, mask_message if self.strategy == "template" else None)
+            entries = self.cluster(merged)
+            cross_file_stage.set(input_clusters=sum(len(entries) for entries in file_entries.values()), merged_clusters=len(merged), clusters=len(entries))
+        return entries
+
+
+# Worker process state, each worker opens the bundle once and reuses it for every file
+_worker_file_systems: Dict[str, FileSystem] = {}
+
+
+def cluster_file_compact(path: str, file: str, threshold: float, strategy: str, selection: Optional[LogSelection] = None) -> Tuple[List[CompactCluster], Dict[str, Any]]:
+    """
+    Read and cluster a single file in a worker process, returning the clusters in compact form and the file metrics.
+    """
+    fs = _worker_file_systems.get(path)
+    if fs is None:
+        fs = FileSystem(path)
+        _worker_file_systems[path] = fs
+
+    clusters, file_metrics = LogClusterer(threshold, strategy).cluster_file_with_metrics(fs, file, selection)
+    return to_compact_clusters(clusters), file_metrics
+
+
+def to_compact_clusters(clusters: List[LogEntry]) -> List[CompactCluster]:
+    """Return the clusters of a single file in compact form. The columns are copied, merging the clusters later does not change them."""
+    return [(entry.message, array("I", entry.references.lines), array("q", entry.references.timestamps)) for entry in clusters]
+
+
+def expand_compact_clusters(compact_clusters: List[CompactCluster], file: str) -> List[LogEntry]:
+    """Rebuild the log entries of a file from their compact form."""
+    file_id = intern_file(file)
+    entries = []
+    for message, lines, timestamps in compact_clusters:
+        entry = LogEntry(message=message)
+        entry.references.extend_file(file_id, lines, timestamps)
+        entries.append(entry)
+    return entries
+
+
+def merge_identical_clusters(file_entries: Dict[str, List[LogEntry]], get_key: Optional[Callable[[str], str]] = None) -> List[LogEntry]:
+    """
+    Merge the per-file clusters whose representatives have the same key, the first step of the cross file pass.
+
+    Pods of the same deployment log the same messages, so many per-file clusters have a copy in other files. Merging
+    these by hash leaves fewer entries for the similarity pass, which is quadratic for the fuzzy strategy. Only entries
+    that the similarity pass would treat as identical may share a key. Files are merged in name order and the merged
+    entries are ordered by reference count, then by key, so the clusters and their references do not depend on the
+    order the files were listed or clustered in.
+
+    :param file_entries: File -> clusters of the file.
+    :param get_key: Returns the key of a message, such as `mask_message`, by default the message itself.
+    :return: The merged entries, the entries of `file_entries` are merged into and should not be used afterwards.
+    """
+    merged: Dict[str, LogEntry] = {}
+    for file in sorted(file_entries):
+        for entry in file_entries[file]:
+            key = get_key(entry.message) if get_key else entry.message
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = entry
+            else:
+                existing.merge(entry)
+
+    # Frequent messages first so they become the representatives of the similarity pass
+    return [merged[key] for key in sorted(merged, key=lambda key: (-len(merged[key].references), key))]
 
 
 def allow_log_path(path: str, namespace: str) -> bool:
-    lower_path = path.lower()
-    if lower_path.startswith(f"{namespace.lower()}/") and lower_path.endswith(".log"):
-        return True
-    return False
+    return LogSelection([namespace]).allow_file(path)
 
 
-def get_log_entries(log_lines: List[str], log_file: str) -> List[LogEntry]:
+def get_log_entries(log_lines: Iterable[str], log_file: str, reference_time: Optional[datetime] = None) -> List[LogEntry]:
     """
     Process a list of log lines and return log entries.
 
     :param log_lines: List of log lines.
     :param log_file: The name of the log file.
+    :param reference_time: Modification time of the log file, see `iter_log_entries`.
     :return: List of LogEntry objects.
     """
-    log_entries = []
-    for i in range(0, len(log_lines)):
-        line = log_lines[i].strip()
+    return list(iter_log_entries(log_lines, log_file, reference_time))
+
+
+def iter_log_entries(log_lines: Iterable[str], log_file: str, reference_time: Optional[datetime] = None) -> Iterator[LogEntry]:
+    """
+    Lazily process log lines and yield log entries, one per non-empty line.
+
+    :param log_lines: Iterable of log lines, such as `FileSystem.iter_lines`.
+    :param log_file: The name of the log file.
+    :param reference_time: Modification time of the log file, such as `FileSystem.get_file_time`. Timestamps without
+        a year are put before it, defaults to now.
+    :return: Iterator of LogEntry objects.
+    """
+    timestamp_parser = TimestampParser(reference_time=reference_time)
+    for i, line in enumerate(log_lines):
+        line = line.strip()
         if line:  # ignore empty lines
-            timestamp = get_timestamp(line)
+            timestamp = timestamp_parser.parse(line)
             log_entry = LogEntry(message=line)
             log_entry.add_ref(LogEntryRef(log_file, i, timestamp))
-            log_entries.append(log_entry)
-    return log_entries
+            yield log_entry
 
 
 def get_timestamp(text: str) -> Optional[datetime]:
     """
     Return the first timestamp in the string if any exist, otherwise None.
+    See `core.timestamp` for the supported formats.
     """
-    timestamp_patterns = [
-        r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d{3}Z",  # ISO 8601 format
-    ]
-
-    first_timestamp = None
-    for pattern in timestamp_patterns:
-        match = re.search(pattern, text)
-        if match:
-            first_timestamp = match.group(0)
-            try:
-                return datetime.fromisoformat(first_timestamp)
-            except:  # noqa: E722
-                # Ignore
-                pass
-
-    return None
+    return parse_timestamp(text)
 
 
-def fuzzy_match_entries(entries: List[LogEntry], threshold: float) -> List[LogEntry]:
+def fuzzy_match_entries(entries: Iterable[LogEntry], threshold: float) -> List[LogEntry]:
     """
     Cluster the entries based on the similarity of their message fields.
 
@@ -87,25 +275,14 @@ def fuzzy_match_entries(entries: List[LogEntry], threshold: float) -> List[LogEn
       - For each entry:
         * Compare its message with representative messages of existing clusters.
         * If it matches a cluster's representative message with similarity >= threshold,
-          add it to that cluster.
+          add it to the first such cluster.
         * Otherwise, create a new cluster.
 
-    Note: This is O(N^2) in worst case and may be slow for very large entries.
-    For efficiency, consider using a more advanced technique or indexing.
+    Representatives are held in a `FuzzyIndex` so each entry is only scored against the
+    candidates whose length can reach the threshold. This is still O(N^2) in the worst case,
+    see `template_match_entries` for a close to linear alternative.
     """
-    clusters: List[LogEntry] = []
+    index = FuzzyIndex(threshold)
     for entry in entries:
-        matched_cluster = False
-        for cluster in clusters:
-            # Compare against the cluster's representative message
-            similarity = fuzz.ratio(entry.message, cluster.message)
-            if similarity >= threshold:
-                # Add to this cluster
-                cluster.merge(entry)
-                matched_cluster = True
-                break
-        if not matched_cluster:
-            # Create a new cluster
-            clusters.append(entry)
-
-    return clusters
+        index.add(entry)
+    return index.get_entries()
@@ -1,65 +1,105 @@
 from datetime import datetime
-from typing import List, Dict, Set, Any
+from typing import List, Dict, Any, Optional
 
-from .log_entry import LogEntry, parse_pod_info
+from .log_entry import NO_TIMESTAMP, LogEntry, RefStats, from_epoch_micros, get_file_pod_info
+from .log_histogram import ClusterHistograms
+from .metrics import stage
 
+# Number of other entries that burst at the same time listed for an entry
+CONTEXT_CO_OCCURRING = 3
 
+
+# Adds the context of each log entry (pods, occurrences, time range and bursts) and ranks the entries, entries
+# that burst the most come first
 class LogContextualizer:
-    def __init__(self) -> None:
-        pass
+    def __init__(self, max_entries: Optional[int] = None) -> None:
+        """
+        :param max_entries: Keep only this many of the highest ranked entries, all of them if None.
+        """
+        self.max_entries = max_entries
 
     def contextualize(self, entries: List[LogEntry]) -> List[Dict[str, Any]]:
-        # Group by namespace/component
-        namespace_component_sets: Dict[tuple[str, str], Set[LogEntry]] = {}
-        results: List[Dict[str, Any]] = []
+        with stage("contextualize") as contextualize_stage:
+            results = self._contextualize(entries)
+            contextualize_stage.set(entries=len(entries), context_entries=len(results))
+        return results
 
-        for entry in entries:
-            for ref in entry.references:
-                info = parse_pod_info(ref.file)
+    def _contextualize(self, entries: List[LogEntry]) -> List[Dict[str, Any]]:
+        # Group by namespace/component, each entry is aggregated from its per file reference
+        # stats so references are never visited one at a time
+        namespace_component_groups: Dict[tuple[str, str], List[Dict[str, Any]]] = {}
 
+        for index, entry in enumerate(entries):
+            entry_groups: Dict[tuple[str, str], Dict[str, Any]] = {}
+            for file_id, stats in entry.references.file_stats.items():
+                info = get_file_pod_info(file_id)
                 key = (info.namespace, info.component)
-                if key not in namespace_component_sets:
-                    namespace_component_sets[key] = set()
-                namespace_component_sets[key].add(entry)
-
-        # Create filtered entries for each namespace/component
-        for key, entry_set in namespace_component_sets.items():
-            for entry in entry_set:
-                output_entry: Dict[str, Any] = {
-                    "message": entry.message,
-                    "namespace": key[0],
-                    "component": key[1],
-                    "pods": [],
-                    "occurrences": 0,
-                }
-                results.append(output_entry)
-
-                for ref in entry.references:
-                    info = parse_pod_info(ref.file)
-
-                    # Filter to only references within the current namespace/component
-                    if info.namespace == key[0] and info.component == key[1]:
-                        output_entry["occurrences"] += 1
 
-                        if info.pod not in output_entry["pods"]:
-                            output_entry["pods"].append(info.pod)
+                output_entry = entry_groups.get(key)
+                if output_entry is None:
+                    output_entry = {
+                        "id": entry.get_id(),
+                        "message": entry.message,
+                        "namespace": key[0],
+                        "component": key[1],
+                        "pods": [],
+                        "occurrences": 0,
+                        "stats": [],
+                        "index": index,
+                    }
+                    entry_groups[key] = output_entry
+                    namespace_component_groups.setdefault(key, []).append(output_entry)
+
+                output_entry["occurrences"] += stats.count
+                if info.pod not in output_entry["pods"]:
+                    output_entry["pods"].append(info.pod)
+                output_entry["stats"].append(stats)
 
-                        if ref.timestamp:
-                            if not output_entry.get("first_timestamp") or ref.timestamp < output_entry["first_timestamp"]:
-                                output_entry["first_timestamp"] = ref.timestamp
-
-                            if not output_entry.get("last_timestamp") or ref.timestamp > output_entry["last_timestamp"]:
-                                output_entry["last_timestamp"] = ref.timestamp
+        results: List[Dict[str, Any]] = []
+        for group in namespace_component_groups.values():
+            for output_entry in group:
+                first_timestamp, last_timestamp = get_time_range(output_entry.pop("stats"))
+                if first_timestamp:
+                    output_entry["first_timestamp"] = datetime_to_string(first_timestamp)
+                if last_timestamp:
+                    output_entry["last_timestamp"] = datetime_to_string(last_timestamp)
+                results.append(output_entry)
 
-        # Convert timestamps to strings
-        for result_entry in results:
-            if "first_timestamp" in result_entry:
-                result_entry["first_timestamp"] = datetime_to_string(result_entry["first_timestamp"])
+        # Entries that burst come first, by burst score, then the rest by occurrences
+        histograms = ClusterHistograms(entries)
+        burst_ranks = {index: rank for rank, index in enumerate(histograms.get_top_bursts())}
+        results.sort(key=lambda output_entry: (burst_ranks.get(output_entry["index"], len(burst_ranks)), -output_entry["occurrences"]))
+        if self.max_entries is not None:
+            results = results[: self.max_entries]
+        add_bursts(histograms, results)
+        return results
 
-            if "last_timestamp" in result_entry:
-                result_entry["last_timestamp"] = datetime_to_string(result_entry["last_timestamp"])
 
-        return results
+def add_bursts(histograms: ClusterHistograms, results: List[Dict[str, Any]]) -> None:
+    """
+    Add the burst score of each entry to its context. Entries that burst also get the time range of the burst, the
+    occurrences of the entry in all pods during it and the ids of the entries that burst at the same time. See
+    `ClusterHistograms`.
+    """
+    entries = histograms.entries
+    for output_entry in results:
+        index = output_entry.pop("index")
+        burst = histograms.bursts[index]
+        output_entry["burst_score"] = round(burst.score, 1) if burst else 0.0
+        if burst is None:
+            continue
+        output_entry["burst_start"] = datetime_to_string(histograms.get_bin_start(burst.start))
+        output_entry["burst_end"] = datetime_to_string(histograms.get_bin_end(burst.end))
+        # The end of the window is inclusive, the last bin of the burst is the one that contains its start
+        output_entry["burst_occurrences"] = histograms.get_window_counts(histograms.get_bin_start(burst.start), histograms.get_bin_start(burst.end), [index])[0]
+        output_entry["co_occurring"] = [entries[other].get_id() for other, _ in histograms.get_co_occurring(index, CONTEXT_CO_OCCURRING)]
+
+
+def get_time_range(stats: List[RefStats]) -> tuple[Optional[datetime], Optional[datetime]]:
+    """Return the first and last timestamps across the reference stats of several files."""
+    first = min((file_stats.first for file_stats in stats if file_stats.first != NO_TIMESTAMP), default=NO_TIMESTAMP)
+    last = max((file_stats.last for file_stats in stats), default=NO_TIMESTAMP)
+    return from_epoch_micros(first), from_epoch_micros(last)
 
 
 def datetime_to_string(dt: datetime) -> str:
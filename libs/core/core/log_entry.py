@@ -1,7 +1,10 @@
 import base64
 import hashlib
 import re
+from array import array
 from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
 
 # reference to a log entry
 LogEntryRef = namedtuple("LogEntryRef", ["file", "line", "timestamp"])
@@ -11,6 +14,170 @@ PodInfo = namedtuple("PodInfo", ["namespace", "component", "pod", "container"])
 
 POD_INFO_PATTERN = re.compile(r"^(?:(?P<namespace>[^/]+)/)?" r"(?:(?P<component>[^/]+)/)?" r"pod\.(?P<pod>[^.]+?)(?:\.(?P<container>[^.]+))?\.log$")
 
+# Timestamps are stored as microseconds since the epoch, this marks a reference without one
+NO_TIMESTAMP = -(2**63)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+# Interned file names, references store the index of their file in this table. The table holds every file name
+# interned by the process, a long running process that reads many bundles clears it with `clear_files`.
+_file_names: List[str] = []
+_file_ids: Dict[str, int] = {}
+_file_pod_infos: Dict[int, PodInfo] = {}
+
+
+def intern_file(file: str) -> int:
+    """Return the id of a file name, adding it to the file table if needed."""
+    file_id = _file_ids.get(file)
+    if file_id is None:
+        file_id = len(_file_names)
+        _file_names.append(file)
+        _file_ids[file] = file_id
+    return file_id
+
+
+def get_file_name(file_id: int) -> str:
+    return _file_names[file_id]
+
+
+def clear_files() -> None:
+    """
+    Remove all file names from the file table. The references of entries created before the call point to ids that
+    are no longer valid or are reused for other files, so those entries must not be used afterwards.
+    """
+    _file_names.clear()
+    _file_ids.clear()
+    _file_pod_infos.clear()
+
+
+def get_file_pod_info(file_id: int) -> PodInfo:
+    """Return the parsed pod info of an interned file, each file is only parsed once."""
+    info = _file_pod_infos.get(file_id)
+    if info is None:
+        info = parse_pod_info(_file_names[file_id])
+        _file_pod_infos[file_id] = info
+    return info
+
+
+def to_epoch_micros(timestamp: Optional[datetime]) -> int:
+    """Convert a timestamp to microseconds since the epoch, naive timestamps are treated as UTC."""
+    if timestamp is None:
+        return NO_TIMESTAMP
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+def from_epoch_micros(value: int) -> Optional[datetime]:
+    """Convert microseconds since the epoch back to a UTC timestamp."""
+    if value == NO_TIMESTAMP:
+        return None
+    return EPOCH + timedelta(microseconds=value)
+
+
+# Running aggregates for the references of a single file
+class RefStats:
+    __slots__ = ["count", "first", "last"]
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.first = NO_TIMESTAMP
+        self.last = NO_TIMESTAMP
+
+    def update(self, count: int, first: int, last: int) -> None:
+        self.count += count
+        if first != NO_TIMESTAMP and (self.first == NO_TIMESTAMP or first < self.first):
+            self.first = first
+        if last > self.last:
+            self.last = last
+
+
+# Columnar storage for the references of a log entry. Each reference is a file id, line number
+# and timestamp in parallel arrays, with per file aggregates kept up to date as references are added.
+class LogEntryRefs:
+    __slots__ = ["files", "lines", "timestamps", "file_stats"]
+
+    def __init__(self) -> None:
+        self.files = array("I")
+        self.lines = array("I")
+        self.timestamps = array("q")
+        self.file_stats: Dict[int, RefStats] = {}
+
+    def add(self, ref: LogEntryRef) -> None:
+        self.append(intern_file(ref.file), ref.line, to_epoch_micros(ref.timestamp))
+
+    def append(self, file_id: int, line: int, timestamp: int) -> None:
+        self.files.append(file_id)
+        self.lines.append(line)
+        self.timestamps.append(timestamp)
+        self._update_stats(file_id, 1, timestamp, timestamp)
+
+    def extend_file(self, file_id: int, lines: "array[int]", timestamps: "array[int]") -> None:
+        """Append the columns of references that all point to the same file."""
+        self.files.extend(array("I", [file_id]) * len(lines))
+        self.lines.extend(lines)
+        self.timestamps.extend(timestamps)
+        known = [timestamp for timestamp in timestamps if timestamp != NO_TIMESTAMP]
+        self._update_stats(file_id, len(lines), min(known, default=NO_TIMESTAMP), max(known, default=NO_TIMESTAMP))
+
+    def extend_columns(self, files: "array[int]", lines: "array[int]", timestamps: "array[int]") -> None:
+        """Append references given as columns of file ids, line numbers and timestamps."""
+        self.files.extend(files)
+        self.lines.extend(lines)
+        self.timestamps.extend(timestamps)
+        for file_id, timestamp in zip(files, timestamps):
+            self._update_stats(file_id, 1, timestamp, timestamp)
+
+    def extend(self, other: "LogEntryRefs") -> None:
+        """Append all references of `other`, merging its aggregates instead of re-adding each reference."""
+        self.files.extend(other.files)
+        self.lines.extend(other.lines)
+        self.timestamps.extend(other.timestamps)
+        for file_id, stats in other.file_stats.items():
+            self._update_stats(file_id, stats.count, stats.first, stats.last)
+
+    def get_first_timestamp(self) -> Optional[datetime]:
+        firsts = [stats.first for stats in self.file_stats.values() if stats.first != NO_TIMESTAMP]
+        return from_epoch_micros(min(firsts)) if firsts else None
+
+    def get_last_timestamp(self) -> Optional[datetime]:
+        return from_epoch_micros(max((stats.last for stats in self.file_stats.values()), default=NO_TIMESTAMP))
+
+    def get_file_counts(self) -> Dict[str, int]:
+        """Return the number of references per file."""
+        return {get_file_name(file_id): stats.count for file_id, stats in self.file_stats.items()}
+
+    def _update_stats(self, file_id: int, count: int, first: int, last: int) -> None:
+        stats = self.file_stats.get(file_id)
+        if stats is None:
+            stats = RefStats()
+            self.file_stats[file_id] = stats
+        stats.update(count, first, last)
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def __iter__(self) -> Iterator[LogEntryRef]:
+        for file_id, line, timestamp in zip(self.files, self.lines, self.timestamps):
+            yield LogEntryRef(get_file_name(file_id), line, from_epoch_micros(timestamp))
+
+    def __getstate__(self) -> Tuple[List[str], "array[int]", "array[int]", "array[int]"]:
+        # File ids are only valid in this process, send the file names along with the columns
+        file_ids = list(self.file_stats)
+        local_ids = {file_id: i for i, file_id in enumerate(file_ids)}
+        files = array("I", (local_ids[file_id] for file_id in self.files))
+        return [get_file_name(file_id) for file_id in file_ids], files, self.lines, self.timestamps
+
+    def __setstate__(self, state: Tuple[List[str], "array[int]", "array[int]", "array[int]"]) -> None:
+        file_names, files, lines, timestamps = state
+        file_ids = [intern_file(file_name) for file_name in file_names]
+        self.files = array("I", (file_ids[file_id] for file_id in files))
+        self.lines = lines
+        self.timestamps = timestamps
+        self.file_stats = {}
+        for file_id, timestamp in zip(self.files, self.timestamps):
+            self._update_stats(file_id, 1, timestamp, timestamp)
+
 
 # LogEntry class is used for merging log lines together
 class LogEntry:
@@ -18,7 +185,7 @@ class LogEntry:
 
     def __init__(self, message: str) -> None:
         self.message = message
-        self.references: set[LogEntryRef] = set()
+        self.references = LogEntryRefs()
 
     def add_ref(self, ref: LogEntryRef) -> None:
         """Add a reference to the line in the log file."""
@@ -30,8 +197,7 @@ class LogEntry:
 
     def merge(self, other: "LogEntry") -> None:
         """Merge another log entry into this one."""
-        for ref in other.references:
-            self.add_ref(ref)
+        self.references.extend(other.references)
 
 
 def get_hash(input_string: str, length: int = 6) -> str:
@@ -1,29 +1,171 @@
+import asyncio
 import json
 import logging
-from typing import Any, Dict, List
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from .llm import query_json_llm
+from .llm import PROMPT_TOKEN_BUDGET, get_deployment_name, estimate_tokens, query_json_llm, query_json_llm_async, run_async
+from .llm_cache import VerdictCache
 from .log_entry import LogEntry
-from .prompt import get_prompt
+from .log_preclassifier import PreClassifier, get_samples_fingerprint, load_model, save_model, train_model
+from .metrics import stage
+from .prompt import get_prompt, get_prompt_hash
+from .token_budget import pack_by_tokens, truncate_text
 
+# Maximum entries in a chunk, the response lists the ids of the failures so it grows with the chunk
 FILTER_MAX_ENTRIES = 500
+FILTER_PROMPT = "filter_failures.md"
+
+# Longer messages are truncated, the start and end of a message are enough to classify it
+FILTER_MAX_MESSAGE_TOKENS = 256
+
+# Maximum number of filter requests in flight at once
+FILTER_CONCURRENCY = 8
+
+# Number of the most recently used cached verdicts the pre-classifier model is trained on
+PRECLASSIFIER_TRAINING_SAMPLES = 50_000
+# Trained pre-classifier model, saved next to the verdict cache
+PRECLASSIFIER_MODEL_FILE = "preclassifier.model"
 
 
 class LogFilter:
-    def __init__(self) -> None:
-        pass
+    def __init__(
+        self,
+        concurrency: int = FILTER_CONCURRENCY,
+        cache: Optional[VerdictCache] = None,
+        token_budget: int = PROMPT_TOKEN_BUDGET,
+        preclassifier: Optional[PreClassifier] = None,
+    ) -> None:
+        """
+        :param concurrency: Maximum number of chunks sent to the LLM at the same time.
+        :param cache: Cache of verdicts from previous runs, only uncached entries are sent to the LLM.
+        :param token_budget: Estimated tokens of a filter prompt, entries are packed into chunks that fill it.
+        :param preclassifier: Settles the obvious uncached entries locally, only the rest are sent to the LLM.
+        """
+        self.concurrency = concurrency
+        self.cache = cache
+        self.token_budget = token_budget
+        self.preclassifier = preclassifier
+        # Number of unique messages settled by each tier: cache, severity, model and llm
+        self.tier_counts: Dict[str, int] = {}
 
     def error_entries(self, log_entries: List[LogEntry]) -> List[LogEntry]:
+        """
+        Sync version of `error_entries_async`, see `core.llm.run_async`. Code that runs in an event loop awaits
+        `error_entries_async` instead, this raises a RuntimeError there.
+        """
         # Page the entries through the LLM
-        filtered_entries: List[LogEntry] = []
-        for i in range(0, len(log_entries), FILTER_MAX_ENTRIES):
-            chunk = log_entries[i : i + FILTER_MAX_ENTRIES]
-            filtered_entries.extend(get_error_entries(chunk))
+        return run_async(self.error_entries_async(log_entries))
+
+    async def error_entries_async(self, log_entries: List[LogEntry]) -> List[LogEntry]:
+        """
+        Page the entries through the LLM with up to `concurrency` chunks in flight.
+        Failures are returned in the order of the input entries.
+        """
+        with stage("filter") as filter_stage:
+            failures = await self._filter_entries(log_entries)
+            filter_stage.set(entries=len(log_entries), failures=len(failures), tiers=dict(self.tier_counts))
+        return failures
+
+    async def _filter_entries(self, log_entries: List[LogEntry]) -> List[LogEntry]:
+        verdicts: Dict[str, bool] = {}
+        prompt_hash = get_prompt_hash(FILTER_PROMPT)
+        if self.cache:
+            verdicts = self.cache.get_verdicts((entry.message for entry in log_entries), prompt_hash, get_deployment_name())
+            logging.info(f"Filter cache: {len(verdicts)} cached, {len(log_entries) - len(verdicts)} uncached")
+            self._count_tier("cache", len(verdicts))
+
+        # Local verdicts are not cached, the cache only holds LLM verdicts that the model is trained on
+        if self.preclassifier:
+            local_verdicts = self.preclassifier.classify_messages(entry.message for entry in log_entries if entry.message not in verdicts)
+            for message, (tier, failure) in local_verdicts.items():
+                verdicts[message] = failure
+                self._count_tier(tier, 1)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def filter_chunk(chunk: List[List[LogEntry]]) -> None:
+            # Only the first entry of each group is sent, the others share its verdict
+            async with semaphore:
+                failures = await query_error_entries_async([group[0] for group in chunk])
+            if failures is None:
+                return
+
+            failure_ids = {id(entry) for entry in failures}
+            chunk_verdicts = {entry.message: id(group[0]) in failure_ids for group in chunk for entry in group}
+            verdicts.update(chunk_verdicts)
+            if self.cache:
+                self.cache.put_verdicts(chunk_verdicts, prompt_hash, get_deployment_name())
+
+        # Group the unsettled entries whose messages are the same once truncated, long messages that only
+        # differ past the truncation point are classified once
+        groups: Dict[str, List[LogEntry]] = {}
+        for entry in log_entries:
+            if entry.message not in verdicts:
+                groups.setdefault(truncate_text(entry.message, FILTER_MAX_MESSAGE_TOKENS), []).append(entry)
 
-        return filtered_entries
+        entries_budget = self.token_budget - estimate_tokens(get_prompt(FILTER_PROMPT, ""))
+        chunks = pack_by_tokens(groups.values(), lambda group: get_entry_tokens(group[0]), entries_budget, FILTER_MAX_ENTRIES)
+        logging.info(f"Filtering {len(groups)} messages in {len(chunks)} chunks")
+        self._count_tier("llm", len({entry.message for group in groups.values() for entry in group}))
+        await asyncio.gather(*(filter_chunk(chunk) for chunk in chunks))
+
+        return [entry for entry in log_entries if verdicts.get(entry.message)]
+
+    def _count_tier(self, tier: str, count: int) -> None:
+        self.tier_counts[tier] = self.tier_counts.get(tier, 0) + count
+
+
+def create_preclassifier(cache: Optional[VerdictCache], model_path: Union[str, Path, None] = None) -> PreClassifier:
+    """
+    Create a pre-classifier for the filter. Its model is trained from the cached LLM verdicts
+    when there are enough of them, otherwise it only uses the severity of the lines. The model is saved
+    and reused until the cached verdicts it is trained on change.
+
+    :param cache: Cache of the LLM verdicts, None to only use severity.
+    :param model_path: File of the saved model, defaults to `preclassifier.model` next to the cache.
+    """
+    model = None
+    if cache:
+        samples = cache.get_recent_verdicts(get_prompt_hash(FILTER_PROMPT), get_deployment_name(), PRECLASSIFIER_TRAINING_SAMPLES)
+        path = Path(model_path) if model_path else cache.path.with_name(PRECLASSIFIER_MODEL_FILE)
+        fingerprint = get_samples_fingerprint(samples)
+        model = load_model(path, fingerprint)
+        if model:
+            logging.info(f"Pre-classifier model loaded, trained with {len(samples)} cached verdicts")
+        else:
+            model = train_model(samples)
+            if model:
+                save_model(model, path, fingerprint)
+            logging.info(f"Pre-classifier model {'trained' if model else 'skipped'} with {len(samples)} cached verdicts")
+    return PreClassifier(model)
 
 
 def get_error_entries(log_entries: List[LogEntry]) -> List[LogEntry]:
+    filter_prompt, msg_lookup_by_id = create_filter_prompt(log_entries)
+
+    # Pass filter_prompt to query llm and parse the result as JSON
+    result = query_json_llm(filter_prompt)
+    return get_failure_entries(result, msg_lookup_by_id) or []
+
+
+async def get_error_entries_async(log_entries: List[LogEntry]) -> List[LogEntry]:
+    return await query_error_entries_async(log_entries) or []
+
+
+async def query_error_entries_async(log_entries: List[LogEntry]) -> Optional[List[LogEntry]]:
+    """
+    Return the failures among the entries, or None if the LLM response could not be used.
+    """
+    filter_prompt, msg_lookup_by_id = create_filter_prompt(log_entries)
+    result = await query_json_llm_async(filter_prompt)
+    return get_failure_entries(result, msg_lookup_by_id)
+
+
+def create_filter_prompt(log_entries: List[LogEntry]) -> Tuple[str, Dict[str, LogEntry]]:
+    """
+    Create the filter prompt for the entries along with a lookup table of the entries by message id.
+    """
     # Create a lookup table for messages by id
     msg_lookup_by_id: Dict[str, LogEntry] = {}
     for entry in log_entries:
@@ -35,14 +177,20 @@ def get_error_entries(log_entries: List[LogEntry]) -> List[LogEntry]:
     # logging.info(json.dumps(message_entries, indent=4))
 
     # Call get_prompt and log the result
-    filter_prompt = get_prompt("filter_failures.md", message_json)
+    filter_prompt = get_prompt(FILTER_PROMPT, message_json)
     logging.debug(filter_prompt)
+    return filter_prompt, msg_lookup_by_id
 
-    # Pass filter_prompt to query llm and parse the result as JSON
-    result = query_json_llm(filter_prompt)
+
+def get_failure_entries(result: Any, msg_lookup_by_id: Dict[str, LogEntry]) -> Optional[List[LogEntry]]:
+    """
+    Filter log entries down to the failures listed in the LLM result, or None if the result has no failures list.
+    """
     logging.debug(json.dumps(result))
+    if not isinstance(result, dict) or "failures" not in result:
+        logging.error("Filter result has no failures list, skipping chunk.")
+        return None
 
-    # Filter log entries down to filtered list
     filtered_entries: List[LogEntry] = []
     for id in result["failures"]:
         if id not in msg_lookup_by_id:
@@ -53,14 +201,24 @@ def get_error_entries(log_entries: List[LogEntry]) -> List[LogEntry]:
     return filtered_entries
 
 
+def get_entry_tokens(entry: LogEntry) -> int:
+    """Estimated tokens of the entry in the filter prompt."""
+    return estimate_tokens(json.dumps(create_message_id_entry(entry))) + 1
+
+
 def create_message_id_entries(log_entries: List[LogEntry]) -> List[Dict[str, Any]]:
     """
     Create a list of objects with message and messageID properties from log entries.
+    Long messages are truncated.
 
     :param log_entries: A list of log entries, each containing a message.
     :return: A list of objects with 'message' and 'messageID' properties.
     """
     log_objects: List[Dict[str, Any]] = []
     for entry in log_entries:
-        log_objects.append({"message": entry.message, "messageID": entry.get_id()})
+        log_objects.append(create_message_id_entry(entry))
     return log_objects
+
+
+def create_message_id_entry(entry: LogEntry) -> Dict[str, Any]:
+    return {"message": truncate_text(entry.message, FILTER_MAX_MESSAGE_TOKENS), "messageID": entry.get_id()}
@@ -0,0 +1,135 @@
+import math
+from array import array
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+from .log_entry import EPOCH, NO_TIMESTAMP, LogEntry, to_epoch_micros
+
+# Bins are sized so the time range of the clusters fits in at most this many of them
+HISTOGRAM_MAX_BINS = 240
+HISTOGRAM_MIN_BIN_SECONDS = 1
+
+# Peak bin of a cluster, in standard deviations above its mean rate, needed for a burst
+BURST_MIN_SCORE = 5.0
+# Minimum occurrences in the peak bin of a burst, so that a few lines of a rare cluster are not a burst
+BURST_MIN_COUNT = 10
+# Bins around the peak at this many standard deviations above the mean are part of the burst
+BURST_EXTENT_SCORE = 2.0
+# Minimum cosine similarity of the histograms of two bursting clusters around their bursts for them to co-occur
+CO_OCCURRENCE_MIN_SIMILARITY = 0.5
+# Bins before and after the bursts compared for co-occurrence
+CO_OCCURRENCE_PADDING_BINS = 2
+
+# Bins of the peak of a cluster, `start` and `end` are inclusive bin indexes
+Burst = namedtuple("Burst", ["score", "start", "end", "peak", "peak_count"])
+
+
+# Occurrence counts of clusters in fixed width time bins, shared by all clusters so they can be compared.
+# Histograms are built from the timestamp column of the cluster references, lines without a timestamp are not counted.
+class ClusterHistograms:
+    def __init__(self, entries: Sequence[LogEntry], bin_seconds: Optional[float] = None, max_bins: int = HISTOGRAM_MAX_BINS) -> None:
+        """
+        :param entries: The clusters.
+        :param bin_seconds: Width of a bin, by default the time range of the clusters is split into at most `max_bins` bins.
+        :param max_bins: Maximum number of bins when the width is not given.
+        """
+        self.entries = entries
+        firsts = [stats.first for entry in entries for stats in entry.references.file_stats.values() if stats.first != NO_TIMESTAMP]
+        lasts = [stats.last for entry in entries for stats in entry.references.file_stats.values() if stats.last != NO_TIMESTAMP]
+        self.start = min(firsts, default=0)
+        end = max(lasts, default=0)
+
+        min_width = HISTOGRAM_MIN_BIN_SECONDS * 1_000_000
+        self.width = int(bin_seconds * 1_000_000) if bin_seconds else max(min_width, math.ceil((end - self.start + 1) / max_bins))
+        self.bin_count = (end - self.start) // self.width + 1 if firsts else 0
+        self.counts = [self._get_counts(entry) for entry in entries]
+        self.bursts = [get_burst(counts) for counts in self.counts]
+
+    def get_bin_start(self, index: int) -> datetime:
+        return EPOCH + timedelta(microseconds=self.start + index * self.width)
+
+    def get_bin_end(self, index: int) -> datetime:
+        return self.get_bin_start(index + 1)
+
+    def get_window_counts(self, start: Optional[datetime] = None, end: Optional[datetime] = None, indexes: Optional[Sequence[int]] = None) -> List[int]:
+        """
+        Return the occurrences of each cluster between `start` and `end`, rounded to the bins that overlap the window.
+        Open ends include the bins before or after the other end.
+
+        :param start: Start of the window, None for the start of the histograms.
+        :param end: End of the window, None for the end of the histograms.
+        :param indexes: Clusters to count, all of them if None.
+        """
+        counts_list = self.counts if indexes is None else [self.counts[i] for i in indexes]
+        first = 0 if start is None else max(0, (to_epoch_micros(start) - self.start) // self.width)
+        last = self.bin_count - 1 if end is None else min(self.bin_count - 1, (to_epoch_micros(end) - self.start) // self.width)
+        if first > last:
+            return [0] * len(counts_list)
+        return [sum(counts[first : last + 1]) for counts in counts_list]
+
+    def get_top_bursts(self, count: Optional[int] = None) -> List[int]:
+        """Return the indexes of the `count` clusters with the highest burst scores, all of them if None. Clusters without a burst are not included."""
+        bursting = [(burst.score, i) for i, burst in enumerate(self.bursts) if burst is not None]
+        bursting.sort(key=lambda score_index: -score_index[0])
+        return [i for _, i in bursting[:count]]
+
+    def get_co_occurring(self, index: int, count: int = 3, min_similarity: float = CO_OCCURRENCE_MIN_SIMILARITY) -> List[Tuple[int, float]]:
+        """
+        Return up to `count` other clusters that burst during the burst of cluster `index`, as (index, similarity) pairs
+        ordered by the cosine similarity of their histograms from just before the first burst to just after the last one.
+        """
+        burst = self.bursts[index]
+        if burst is None:
+            return []
+
+        results = []
+        for other, other_burst in enumerate(self.bursts):
+            if other == index or other_burst is None or other_burst.end < burst.start or other_burst.start > burst.end:
+                continue
+            first = max(0, min(burst.start, other_burst.start) - CO_OCCURRENCE_PADDING_BINS)
+            last = max(burst.end, other_burst.end) + CO_OCCURRENCE_PADDING_BINS + 1
+            similarity = get_cosine_similarity(self.counts[index][first:last], self.counts[other][first:last])
+            if similarity >= min_similarity:
+                results.append((other, similarity))
+        results.sort(key=lambda result: -result[1])
+        return results[:count]
+
+    def _get_counts(self, entry: LogEntry) -> "array[int]":
+        counts = array("I", bytes(4 * self.bin_count))
+        start = self.start
+        width = self.width
+        for timestamp in entry.references.timestamps:
+            if timestamp != NO_TIMESTAMP:
+                counts[(timestamp - start) // width] += 1
+        return counts
+
+
+def get_burst(counts: Sequence[int]) -> Optional[Burst]:
+    """
+    Return the burst of a histogram, or None if its peak bin is not far enough above its mean rate.
+    The score is the number of standard deviations of the peak above the mean, assuming Poisson distributed counts.
+    """
+    if not counts:
+        return None
+    mean = sum(counts) / len(counts)
+    deviation = math.sqrt(mean + 1)
+    peak = max(range(len(counts)), key=counts.__getitem__)
+    score = (counts[peak] - mean) / deviation
+    if score < BURST_MIN_SCORE or counts[peak] < BURST_MIN_COUNT:
+        return None
+
+    threshold = mean + BURST_EXTENT_SCORE * deviation
+    start = end = peak
+    while start > 0 and counts[start - 1] >= threshold:
+        start -= 1
+    while end < len(counts) - 1 and counts[end + 1] >= threshold:
+        end += 1
+    return Burst(score, start, end, peak, counts[peak])
+
+
+def get_cosine_similarity(a: Sequence[int], b: Sequence[int]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    if dot == 0:
+        return 0.0
+    return dot / math.sqrt(sum(x * x for x in a) * sum(y * y for y in b))
@@ -0,0 +1,193 @@
+import hashlib
+import math
+import os
+import random
+import re
+import struct
+import zlib
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from .log_template_miner import mask_message
+
+# Severity fields: logfmt and JSON levels, klog headers, then bare or bracketed level names
+LEVEL_FIELD_PATTERN = re.compile(r"\b(?:level|lvl|severity)\"?\s*[=:]\s*\"?([A-Za-z]+)", re.IGNORECASE)
+KLOG_LEVEL_PATTERN = re.compile(r"(?:^|\s)([IWEF])\d{4} \d{2}:\d{2}:\d{2}")
+LEVEL_NAME_PATTERN = re.compile(r"(?:^|[\s\[<])(TRACE|DEBUG|INFO|WARN|WARNING|ERROR|ERR|FATAL|CRITICAL|PANIC)(?=[\]\s:>]|$)")
+# Go panics and stack traces, these are failures whatever the level says
+PANIC_PATTERN = re.compile(r"\bpanic:|goroutine \d+ \[running\]")
+# Words that make a line worth a closer look even if its level says it is not an error
+FAILURE_WORDS_PATTERN = re.compile(r"error|fail|exception|panic|fatal|timeout|timed out|refused|denied|unavailable|crash|\boom|killed", re.IGNORECASE)
+
+ERROR_LEVELS = {"e", "f", "err", "error", "fatal", "critical", "crit", "panic", "dpanic", "alert", "emerg", "emergency"}
+NOISE_LEVELS = {"i", "info", "debug", "trace", "verbose", "notice"}
+
+# Number of hashed features of the model, collisions are rare enough at this size for log vocabularies
+MODEL_FEATURES = 2**18
+MODEL_EPOCHS = 5
+MODEL_LEARNING_RATE = 0.1
+
+# The model is only used once it has seen enough verdicts of both kinds
+MODEL_MIN_SAMPLES = 200
+MODEL_MIN_FAILURES = 20
+
+# Probabilities beyond which the model's verdict is trusted without asking the LLM
+ACCEPT_PROBABILITY = 0.97
+DROP_PROBABILITY = 0.01
+
+TOKEN_PATTERN = re.compile(r"<\w+>|[a-z_]+")
+
+# Saved model file: magic, fingerprint of the training samples, bias, then the weights
+MODEL_MAGIC = b"AETHMDL1"
+MODEL_PREFIX = struct.Struct("<8s32sd")
+
+
+def get_level(message: str) -> Optional[str]:
+    """Return the lower case severity level of a log line, or None if it has none."""
+    match = LEVEL_FIELD_PATTERN.search(message) or KLOG_LEVEL_PATTERN.search(message) or LEVEL_NAME_PATTERN.search(message)
+    return match.group(1).lower() if match else None
+
+
+def get_severity_verdict(message: str) -> Optional[bool]:
+    """
+    Classify a log line from its severity. Returns True for errors and panics, False for info and
+    lower levels without any failure words, and None when the severity does not settle it.
+    """
+    if PANIC_PATTERN.search(message):
+        return True
+    level = get_level(message)
+    if level in ERROR_LEVELS:
+        return True
+    if level in NOISE_LEVELS and not FAILURE_WORDS_PATTERN.search(message):
+        return False
+    return None
+
+
+def get_features(message: str) -> List[int]:
+    """Hashed unigram and bigram features of the masked, lower case words of a message."""
+    tokens = TOKEN_PATTERN.findall(mask_message(message).lower())
+    ngrams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    # crc32 is stable across runs, unlike hash() of str
+    return list({zlib.crc32(ngram.encode()) % MODEL_FEATURES for ngram in ngrams})
+
+
+# Logistic regression over hashed n-grams, trained from the cached verdicts. The trained model is saved with the
+# fingerprint of its samples, see `load_model`, and is only trained again when the samples change.
+class NgramModel:
+    def __init__(self, features: int = MODEL_FEATURES) -> None:
+        self.weights = array("d", bytes(8 * features))
+        self.bias = 0.0
+
+    def predict(self, message: str) -> float:
+        """Return the probability that the message is a failure."""
+        return self._predict_features(get_features(message))
+
+    def train(self, samples: List[Tuple[str, bool]], epochs: int = MODEL_EPOCHS, learning_rate: float = MODEL_LEARNING_RATE, seed: int = 0) -> None:
+        """
+        Fit the model with stochastic gradient descent.
+
+        :param samples: Messages and their verdicts, True for failures.
+        :param epochs: Number of passes over the samples.
+        :param learning_rate: Step size of the updates.
+        :param seed: Seed of the shuffling between epochs.
+        """
+        featurized = [(get_features(message), 1.0 if failure else 0.0) for message, failure in samples]
+        rng = random.Random(seed)
+        weights = self.weights
+        for _ in range(epochs):
+            rng.shuffle(featurized)
+            for features, label in featurized:
+                gradient = (self._predict_features(features) - label) * learning_rate
+                for feature in features:
+                    weights[feature] -= gradient
+                self.bias -= gradient
+
+    def _predict_features(self, features: List[int]) -> float:
+        weights = self.weights
+        z = self.bias + sum(weights[feature] for feature in features)
+        # Clamp to keep exp in range
+        z = max(-30.0, min(30.0, z))
+        return 1.0 / (1.0 + math.exp(-z))
+
+
+def train_model(samples: Iterable[Tuple[str, bool]]) -> Optional[NgramModel]:
+    """Train a model from verdicts, or return None if there are too few to trust it."""
+    sample_list = list(samples)
+    failures = sum(1 for _, failure in sample_list if failure)
+    if len(sample_list) < MODEL_MIN_SAMPLES or failures < MODEL_MIN_FAILURES or failures == len(sample_list):
+        return None
+    model = NgramModel()
+    model.train(sample_list)
+    return model
+
+
+def get_samples_fingerprint(samples: Iterable[Tuple[str, bool]]) -> bytes:
+    """Return a hash of the training samples and parameters, it does not depend on the order of the samples."""
+    digest = hashlib.sha256(f"{MODEL_FEATURES} {MODEL_EPOCHS} {MODEL_LEARNING_RATE}".encode())
+    for message, failure in sorted(samples):
+        digest.update(f"{int(failure)}{len(message)}:{message}".encode())
+    return digest.digest()
+
+
+def save_model(model: NgramModel, path: Union[str, Path], fingerprint: bytes) -> None:
+    """Write the model along with the fingerprint of its training samples, replacing the file atomically."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MODEL_PREFIX.pack(MODEL_MAGIC, fingerprint, model.bias))
+        f.write(model.weights.tobytes())
+    os.replace(tmp_path, path)
+
+
+def load_model(path: Union[str, Path], fingerprint: bytes) -> Optional[NgramModel]:
+    """Return the model saved at `path` if it was trained on the samples of `fingerprint`, otherwise None."""
+    try:
+        with open(path, "rb") as f:
+            magic, saved_fingerprint, bias = MODEL_PREFIX.unpack(f.read(MODEL_PREFIX.size))
+            if magic != MODEL_MAGIC or saved_fingerprint != fingerprint:
+                return None
+            model = NgramModel(0)
+            model.weights.fromfile(f, MODEL_FEATURES)
+    except (OSError, EOFError, ValueError, struct.error):  # missing or truncated
+        return None
+    model.bias = bias
+    return model
+
+
+# Settles the obvious log entries before they are sent to the LLM filter. Severity fields are checked first,
+# then the optional model. Entries neither is confident about are left for the LLM.
+class PreClassifier:
+    def __init__(self, model: Optional[NgramModel] = None, accept_probability: float = ACCEPT_PROBABILITY, drop_probability: float = DROP_PROBABILITY) -> None:
+        """
+        :param model: Model trained from earlier LLM verdicts, None to only use severity.
+        :param accept_probability: Model probability at or above which a message is a failure.
+        :param drop_probability: Model probability at or below which a message is not a failure.
+        """
+        self.model = model
+        self.accept_probability = accept_probability
+        self.drop_probability = drop_probability
+
+    def classify(self, message: str) -> Optional[Tuple[str, bool]]:
+        """Return the tier that settled the message ("severity" or "model") and its verdict, or None if the LLM should decide."""
+        verdict = get_severity_verdict(message)
+        if verdict is not None:
+            return "severity", verdict
+
+        if self.model:
+            probability = self.model.predict(message)
+            if probability >= self.accept_probability:
+                return "model", True
+            if probability <= self.drop_probability:
+                return "model", False
+        return None
+
+    def classify_messages(self, messages: Iterable[str]) -> Dict[str, Tuple[str, bool]]:
+        """Return the tier and verdict of each message that could be settled locally."""
+        results: Dict[str, Tuple[str, bool]] = {}
+        for message in messages:
+            result = self.classify(message)
+            if result:
+                results[message] = result
+        return results
@@ -0,0 +1,76 @@
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+from typing import List, Optional, Sequence
+
+from .log_entry import parse_pod_info
+
+
+def to_utc(timestamp: Optional[datetime]) -> Optional[datetime]:
+    """Return the timestamp with a time zone, naive timestamps are treated as UTC."""
+    if timestamp is not None and timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+# Selects the log files and lines of a bundle to analyze. Files are selected from their path alone, before they are
+# opened, and lines outside of the time window are skipped before any log entries are created for them.
+class LogSelection:
+    def __init__(
+        self,
+        namespaces: Sequence[str],
+        include: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> None:
+        """
+        :param namespaces: Namespaces to analyze, as names or globs such as `azure-iot-*`.
+        :param include: Globs of the components and containers to analyze, all of them if empty. A glob is matched
+            against the component, the container and `component/container` of a file, e.g. `broker`, `*operator` or `broker/backend`.
+        :param exclude: Globs of the components and containers to skip, matched like `include`.
+        :param start: Skip the lines logged before this time, naive times are UTC.
+        :param end: Skip the lines logged after this time, naive times are UTC.
+        """
+        self.namespaces = [namespace.lower() for namespace in namespaces]
+        self.include = [pattern.lower() for pattern in include]
+        self.exclude = [pattern.lower() for pattern in exclude]
+        self.start = to_utc(start)
+        self.end = to_utc(end)
+        if self.start and self.end and self.start > self.end:
+            raise ValueError("The start of the time window must not be after its end.")
+
+    def allow_file(self, path: str) -> bool:
+        """Return True if the log file at `path` in the bundle is selected."""
+        lower_path = path.lower()
+        if not lower_path.endswith(".log"):
+            return False
+
+        # Files that are not named like pod logs still belong to the namespace and component of their folders
+        info = parse_pod_info(lower_path)
+        folders = lower_path.split("/")[:-1]
+        namespace = info.namespace or (folders[0] if folders else None)
+        component = info.component or (folders[1] if len(folders) > 1 else None)
+        if namespace is None or not any(fnmatchcase(namespace, pattern) for pattern in self.namespaces):
+            return False
+
+        names = [name for name in [component, info.container] if name]
+        if component and info.container:
+            names.append(f"{component}/{info.container}")
+        if self.include and not any(fnmatchcase(name, pattern) for pattern in self.include for name in names):
+            return False
+        return not any(fnmatchcase(name, pattern) for pattern in self.exclude for name in names)
+
+    def has_time_window(self) -> bool:
+        return self.start is not None or self.end is not None
+
+    def allow_timestamp(self, timestamp: Optional[datetime]) -> bool:
+        """Return True if a line logged at `timestamp` is in the time window. Lines without a timestamp are always kept."""
+        if timestamp is None:
+            return True
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return (self.start is None or timestamp >= self.start) and (self.end is None or timestamp <= self.end)
+
+    def get_time_window(self) -> List[Optional[str]]:
+        """Return the time window as ISO 8601 strings, such as for the configuration of a `BundleIndex`."""
+        return [self.start.isoformat() if self.start else None, self.end.isoformat() if self.end else None]
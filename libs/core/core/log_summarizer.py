@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List
+
+from .llm import PROMPT_TOKEN_BUDGET, SYSTEM_PROMPT, LLMStream, create_messages, estimate_tokens, get_last_message_content, query_llm_async, run_async
+from .metrics import stage
+from .prompt import get_prompt
+from .token_budget import pack_by_tokens, truncate_text
+
+SUMMARIZE_PROMPT = "summarize.md"
+SUMMARIZE_PARTIAL_PROMPT = "summarize_partial.md"
+SUMMARIZE_REDUCE_PROMPT = "summarize_reduce.md"
+
+# Longer messages are truncated, a summary needs the gist of a message and not all of its details
+SUMMARIZE_MAX_MESSAGE_TOKENS = 512
+
+# Maximum tokens of a partial summary, this bounds how many summaries fit in a reduce prompt
+SUMMARIZE_PARTIAL_MAX_TOKENS = 1024
+
+# Maximum number of partial summaries requested at the same time
+SUMMARIZE_CONCURRENCY = 8
+
+
+# Summarizes contextualized log entries with the LLM. When the entries don't fit in a single prompt they are
+# summarized per namespace/component first, then the summaries are combined until they fit in the final prompt.
+class LogSummarizer:
+    def __init__(self, token_budget: int = PROMPT_TOKEN_BUDGET, concurrency: int = SUMMARIZE_CONCURRENCY) -> None:
+        """
+        :param token_budget: Estimated tokens of a summarize prompt.
+        :param concurrency: Maximum number of partial summaries requested at the same time.
+        """
+        self.token_budget = token_budget
+        self.concurrency = concurrency
+
+    def summarize(self, context_entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Return the chat with the summary of the entries as the last message."""
+        return run_async(self.summarize_async(context_entries))
+
+    async def summarize_async(self, context_entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with stage("summarize") as summarize_stage:
+            chat = await query_llm_async(await self._get_prompt(context_entries))
+            summarize_stage.set(entries=len(context_entries))
+        return chat
+
+    def summarize_stream(self, context_entries: List[Dict[str, Any]]) -> LLMStream:
+        """
+        Start summarizing the entries on a background thread and return the stream of the summary, see `LLMStream`.
+        Parts of large inputs are summarized before the summary starts streaming.
+        """
+        summarize_stage = stage("summarize")
+        summarize_stage.set(entries=len(context_entries))
+        return LLMStream(lambda: create_messages(run_async(self._get_prompt(context_entries)), SYSTEM_PROMPT, None), metrics_stage=summarize_stage)
+
+    async def _get_prompt(self, context_entries: List[Dict[str, Any]]) -> str:
+        """Return the prompt of the summary, summarizing parts of the entries first if they don't fit in it."""
+        entries = [truncate_entry(entry) for entry in context_entries]
+        summarize_prompt = get_prompt(SUMMARIZE_PROMPT, json.dumps({"logEntries": entries}))
+        if estimate_tokens(summarize_prompt) <= self.token_budget:
+            logging.debug(summarize_prompt)
+            return summarize_prompt
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        partial_budget = self.token_budget - estimate_tokens(get_prompt(SUMMARIZE_PARTIAL_PROMPT, ""))
+
+        async def summarize_partial(text: str) -> str:
+            async with semaphore:
+                chat = await query_llm_async(get_prompt(SUMMARIZE_PARTIAL_PROMPT, text), max_tokens=SUMMARIZE_PARTIAL_MAX_TOKENS)
+            return get_last_message_content(chat)
+
+        # Map, summarize each namespace/component, splitting the ones that don't fit in a prompt
+        groups: Dict[tuple[str, str], List[Dict[str, Any]]] = {}
+        for entry in entries:
+            groups.setdefault((entry["namespace"], entry["component"]), []).append(entry)
+
+        group_chunks = [(key, chunk) for key, group in groups.items() for chunk in pack_by_tokens(group, lambda entry: estimate_tokens(json.dumps(entry)) + 1, partial_budget)]
+        logging.info(f"Summarizing {len(entries)} entries in {len(group_chunks)} parts")
+        partial_summaries = await asyncio.gather(*(summarize_partial(json.dumps({"logEntries": chunk})) for _, chunk in group_chunks))
+        summaries = [f"## {namespace}/{component}\n\n{summary}" for ((namespace, component), _), summary in zip(group_chunks, partial_summaries)]
+
+        # Reduce, combine summaries until they fit in the final prompt
+        reduce_budget = self.token_budget - estimate_tokens(get_prompt(SUMMARIZE_REDUCE_PROMPT, ""))
+        while sum(estimate_tokens(summary) + 1 for summary in summaries) > reduce_budget:
+            chunks = pack_by_tokens(summaries, lambda summary: estimate_tokens(summary) + 1, partial_budget)
+            if len(chunks) == len(summaries):
+                logging.warning("Summaries are too large to combine, the final prompt exceeds the token budget")
+                break
+            logging.info(f"Combining {len(summaries)} summaries into {len(chunks)}")
+            summaries = list(await asyncio.gather(*(summarize_partial(format_summaries(chunk)) for chunk in chunks)))
+
+        return get_prompt(SUMMARIZE_REDUCE_PROMPT, format_summaries(summaries))
+
+
+def truncate_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the contextualized entry with its message truncated if it is too long."""
+    message = truncate_text(entry["message"], SUMMARIZE_MAX_MESSAGE_TOKENS)
+    if message is entry["message"]:
+        return entry
+    return {**entry, "message": message}
+
+
+def format_summaries(summaries: List[str]) -> str:
+    return "\n\n".join(summaries)
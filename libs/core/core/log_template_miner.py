@@ -0,0 +1,211 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .log_entry import LogEntry
+
+# Wildcard token used for positions that vary between lines of the same template
+WILDCARD = "<*>"
+
+# Variable tokens are masked before mining so that lines differing only by ids, numbers, etc.
+# share a template. Order matters, more specific patterns must come first.
+MASK_PATTERNS: List[Tuple[re.Pattern[str], str]] = [
+    (re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?"), "<TS>"),
+    (re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"), "<UUID>"),
+    (re.compile(r"\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"), "<IP>"),
+    (re.compile(r"\b0[xX][0-9a-fA-F]+\b|\b(?=[0-9a-fA-F]*[a-fA-F])(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{8,}\b"), "<HEX>"),
+    (re.compile(r"(?<![\w.])[-+]?\d+(?:\.\d+)?(?![\d.])"), "<NUM>"),
+]
+
+DEFAULT_DEPTH = 4
+DEFAULT_MAX_CHILDREN = 100
+
+
+def mask_message(message: str) -> str:
+    """
+    Replace the variable parts of a message (timestamps, ids, addresses, numbers) with mask tokens.
+    """
+    for pattern, mask in MASK_PATTERNS:
+        message = pattern.sub(mask, message)
+    return message
+
+
+class TemplateCluster:
+    __slots__ = ["template", "entry"]
+
+    def __init__(self, template: List[str], entry: LogEntry) -> None:
+        self.template = template
+        self.entry = entry
+
+    def get_template(self) -> str:
+        return " ".join(self.template)
+
+
+class _Node:
+    __slots__ = ["children", "clusters"]
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Node"] = {}
+        self.clusters: List[TemplateCluster] = []
+
+
+# Drain style template miner: entries are routed through a fixed depth prefix tree keyed by
+# token count and leading constant tokens, and are only compared against the few templates in the leaf.
+class TemplateMiner:
+    def __init__(self, similarity: float, depth: int = DEFAULT_DEPTH, max_children: int = DEFAULT_MAX_CHILDREN) -> None:
+        """
+        :param similarity: Minimum fraction (0-1) of matching tokens for a line to join a template.
+        :param depth: Depth of the prefix tree, the number of leading constant tokens used for routing is depth - 2.
+        :param max_children: Maximum children per tree node before new tokens fall into the wildcard child.
+        """
+        self.similarity = similarity
+        self.depth = max(depth, 3)
+        self.max_children = max_children
+        self.root: Dict[int, _Node] = {}
+        self.clusters: List[TemplateCluster] = []
+        # Masked message -> cluster, most lines repeat exactly once masked and skip the tree search
+        self.masked_lookup: Dict[str, TemplateCluster] = {}
+
+    def add(self, entry: LogEntry) -> LogEntry:
+        """
+        Add an entry to the miner. Returns the cluster representative the entry was merged into,
+        or the entry itself if it started a new cluster.
+        """
+        masked = mask_message(entry.message)
+        cached = self.masked_lookup.get(masked)
+        if cached is not None:
+            cached.entry.merge(entry)
+            return cached.entry
+
+        tokens = masked.split()
+        leaf = self._get_leaf(tokens)
+
+        match = self._best_match(leaf.clusters, tokens)
+        if match is not None:
+            match.template = merge_template(match.template, tokens)
+            match.entry.merge(entry)
+            self.masked_lookup[masked] = match
+            return match.entry
+
+        self._add_cluster(leaf, TemplateCluster(tokens, entry), masked)
+        return entry
+
+    def get_entries(self) -> List[LogEntry]:
+        """Return the cluster representatives in the order they were created."""
+        return [cluster.entry for cluster in self.clusters]
+
+    def get_templates(self) -> List[List[str]]:
+        """Return the template tokens of each cluster, in the same order as `get_entries`."""
+        return [cluster.template for cluster in self.clusters]
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        Return the templates, prefix tree and masked lookup of the miner as JSON serializable data, such as for a
+        checkpoint. Clusters are referred to by their index in `get_entries`.
+        """
+        indexes = {id(cluster): i for i, cluster in enumerate(self.clusters)}
+
+        def get_node_state(node: _Node) -> Dict[str, Any]:
+            return {"children": {key: get_node_state(child) for key, child in node.children.items()}, "clusters": [indexes[id(cluster)] for cluster in node.clusters]}
+
+        return {
+            "templates": self.get_templates(),
+            "tree": {str(token_count): get_node_state(node) for token_count, node in self.root.items()},
+            "masked_lookup": {masked: indexes[id(cluster)] for masked, cluster in self.masked_lookup.items()},
+        }
+
+    def set_state(self, entries: List[LogEntry], state: Dict[str, Any]) -> None:
+        """
+        Restore the clusters of a miner from the data returned by its `get_state`.
+
+        :param entries: The cluster representatives, in the order of `get_entries`.
+        :param state: The state of the miner.
+        """
+        self.clusters = [TemplateCluster(template, entry) for template, entry in zip(state["templates"], entries)]
+
+        def get_node(node_state: Dict[str, Any]) -> _Node:
+            node = _Node()
+            node.children = {key: get_node(child) for key, child in node_state["children"].items()}
+            node.clusters = [self.clusters[i] for i in node_state["clusters"]]
+            return node
+
+        self.root = {int(token_count): get_node(node_state) for token_count, node_state in state["tree"].items()}
+        self.masked_lookup = {masked: self.clusters[i] for masked, i in state["masked_lookup"].items()}
+
+    def _add_cluster(self, leaf: _Node, cluster: TemplateCluster, masked: str) -> None:
+        leaf.clusters.append(cluster)
+        self.clusters.append(cluster)
+        self.masked_lookup[masked] = cluster
+
+    def _get_leaf(self, tokens: List[str]) -> _Node:
+        node = self.root.get(len(tokens))
+        if node is None:
+            node = _Node()
+            self.root[len(tokens)] = node
+
+        # Leading variable tokens such as timestamps would send every line down the same path
+        route = [token for token in tokens if not is_variable_token(token)][: self.depth - 2]
+        for key in route:
+            child = node.children.get(key)
+            if child is None:
+                if len(node.children) >= self.max_children:
+                    key = WILDCARD
+                    child = node.children.get(key)
+                if child is None:
+                    child = _Node()
+                    node.children[key] = child
+            node = child
+        return node
+
+    def _best_match(self, clusters: List[TemplateCluster], tokens: List[str]) -> Optional[TemplateCluster]:
+        best: Optional[TemplateCluster] = None
+        best_similarity = -1.0
+        best_wildcards = -1
+        for cluster in clusters:
+            similarity, wildcards = get_similarity(cluster.template, tokens)
+            if similarity > best_similarity or (similarity == best_similarity and wildcards > best_wildcards):
+                best, best_similarity, best_wildcards = cluster, similarity, wildcards
+
+        if best is not None and best_similarity >= self.similarity:
+            return best
+        return None
+
+
+def is_variable_token(token: str) -> bool:
+    return token.startswith("<") or any(c.isdigit() for c in token)
+
+
+def get_similarity(template: List[str], tokens: List[str]) -> Tuple[float, int]:
+    """
+    Return the fraction of positions where the template and tokens are equal, along with the
+    number of wildcard positions in the template. Wildcards do not count towards the similarity.
+    """
+    if not template:
+        return 1.0, 0
+
+    equal = 0
+    wildcards = 0
+    for template_token, token in zip(template, tokens):
+        if template_token == WILDCARD:
+            wildcards += 1
+        elif template_token == token:
+            equal += 1
+    return equal / len(template), wildcards
+
+
+def merge_template(template: List[str], tokens: List[str]) -> List[str]:
+    """Replace positions that differ between the template and tokens with a wildcard."""
+    return [template_token if template_token == token else WILDCARD for template_token, token in zip(template, tokens)]
+
+
+def template_match_entries(entries: Iterable[LogEntry], threshold: float) -> List[LogEntry]:
+    """
+    Cluster the entries by mining templates from their message fields.
+
+    The threshold uses the same 0-100 scale as `fuzzy_match_entries` and is applied to the
+    percentage of matching tokens. Each entry is only compared against the templates that
+    share its token count and leading tokens, making this close to linear in the number of entries.
+    """
+    miner = TemplateMiner(threshold / 100)
+    for entry in entries:
+        miner.add(entry)
+    return miner.get_entries()
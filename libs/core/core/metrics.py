@@ -0,0 +1,181 @@
+import math
+import os
+import sys
+import time
+from contextvars import ContextVar, Token
+from types import TracebackType
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore
+
+# Called with the event name and its fields. Events:
+# * stage_start: name
+# * stage: name, wall_seconds, cpu_seconds, peak_rss_bytes and counts of the stage such as lines or entries
+# * file: file, lines, skipped_lines, clusters, read_seconds, parse_seconds, cluster_seconds, wall_seconds
+# * llm_call: latency_seconds, prompt_tokens, completion_tokens, attempts and time_to_first_token_seconds for streamed responses
+# * chat_turn: turn, latency_seconds, time_to_first_token_seconds, prompt_tokens, completion_tokens, prefix_tokens,
+#   history_tokens and compacted_messages of a `ChatSession` turn
+MetricsHook = Callable[[str, Dict[str, Any]], None]
+
+_hooks: List[MetricsHook] = []
+
+
+# Names of the stages entered in the current context, innermost last. Every thread starts without stages, coroutines
+# inherit the stages of the code that started them, including coroutines sent to the event loop by `core.llm.run_async`.
+_active_stages: ContextVar[Tuple[str, ...]] = ContextVar("active_stages", default=())
+
+
+def add_hook(hook: MetricsHook) -> None:
+    """Register a hook that receives every metrics event, such as a `MetricsRecorder`."""
+    _hooks.append(hook)
+
+
+def remove_hook(hook: MetricsHook) -> None:
+    _hooks.remove(hook)
+
+
+def emit(event: str, **fields: Any) -> None:
+    for hook in _hooks:
+        hook(event, fields)
+
+
+def get_active_stage() -> Optional[str]:
+    """Return the name of the innermost stage of the current context, such as the stage that made an LLM call."""
+    stages = _active_stages.get()
+    return stages[-1] if stages else None
+
+
+def get_peak_rss() -> Optional[int]:
+    """Return the peak resident set size of this process in bytes, or None where it is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return int(peak if sys.platform == "darwin" else peak * 1024)
+
+
+def get_cpu_seconds() -> float:
+    """CPU time of this process and its finished child processes, such as clustering workers."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+# Measures a pipeline stage, the stage event is emitted on exit with the counts added by `set`
+class Stage:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.fields: Dict[str, Any] = {}
+        self.start_wall = 0.0
+        self.start_cpu = 0.0
+        self.token: Optional[Token[Tuple[str, ...]]] = None
+
+    def set(self, **fields: Any) -> None:
+        self.fields.update(fields)
+
+    def __enter__(self) -> "Stage":
+        self.token = _active_stages.set(_active_stages.get() + (self.name,))
+        emit("stage_start", name=self.name)
+        self.start_wall = time.perf_counter()
+        self.start_cpu = get_cpu_seconds()
+        return self
+
+    def __exit__(self, exc_type: Optional[Type[BaseException]], exc: Optional[BaseException], tb: Optional[TracebackType]) -> None:
+        emit(
+            "stage",
+            name=self.name,
+            wall_seconds=time.perf_counter() - self.start_wall,
+            cpu_seconds=get_cpu_seconds() - self.start_cpu,
+            peak_rss_bytes=get_peak_rss(),
+            **self.fields,
+        )
+        if self.token is not None:
+            _active_stages.reset(self.token)
+            self.token = None
+
+
+def stage(name: str) -> Stage:
+    return Stage(name)
+
+
+def get_percentile(sorted_values: List[float], percentile: float) -> float:
+    """Nearest rank percentile of sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(percentile / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+# Hook that aggregates the events of a run into a report that can be saved as JSON and compared across versions
+class MetricsRecorder:
+    def __init__(self) -> None:
+        self.start_wall = time.perf_counter()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        # Totals over the files, with worker processes the seconds are summed worker time rather than elapsed time
+        self.files: Dict[str, float] = {"count": 0, "lines": 0, "skipped_lines": 0, "clusters": 0, "read_seconds": 0.0, "parse_seconds": 0.0, "cluster_seconds": 0.0, "wall_seconds": 0.0}
+        # Stage name -> latencies and token counts of the LLM calls made during it
+        self.llm_calls: Dict[str, List[Dict[str, Any]]] = {}
+        self.chat_turns: List[Dict[str, Any]] = []
+
+    def __call__(self, event: str, fields: Dict[str, Any]) -> None:
+        if event == "stage":
+            self.stages[fields["name"]] = {key: value for key, value in fields.items() if key != "name"}
+        elif event == "file":
+            self.files["count"] += 1
+            for key in ["lines", "skipped_lines", "clusters", "read_seconds", "parse_seconds", "cluster_seconds", "wall_seconds"]:
+                self.files[key] += fields[key]
+        elif event == "llm_call":
+            # Hooks are called by `emit` in the context of the caller, the call belongs to its innermost stage
+            self.llm_calls.setdefault(get_active_stage() or "other", []).append(fields)
+        elif event == "chat_turn":
+            self.chat_turns.append(fields)
+
+    def get_report(self) -> Dict[str, Any]:
+        stages: Dict[str, Dict[str, Any]] = {}
+        for name, fields in self.stages.items():
+            report = dict(fields)
+            if fields.get("lines") and fields["wall_seconds"] > 0:
+                report["lines_per_second"] = fields["lines"] / fields["wall_seconds"]
+            if name in self.llm_calls:
+                report["llm"] = get_llm_report(self.llm_calls[name])
+            stages[name] = report
+
+        files: Dict[str, Any] = dict(self.files)
+        if self.files["wall_seconds"] > 0:
+            files["lines_per_second"] = self.files["lines"] / self.files["wall_seconds"]
+
+        return {
+            "wall_seconds": time.perf_counter() - self.start_wall,
+            "cpu_seconds": get_cpu_seconds(),
+            "peak_rss_bytes": get_peak_rss(),
+            "stages": stages,
+            "files": files,
+            "llm": get_llm_report([call for calls in self.llm_calls.values() for call in calls]),
+            "chat_turns": self.chat_turns,
+        }
+
+
+def get_llm_report(calls: List[Dict[str, Any]]) -> Dict[str, Any]:
+    latencies = sorted(call["latency_seconds"] for call in calls)
+    first_token_latencies = sorted(call["time_to_first_token_seconds"] for call in calls if call.get("time_to_first_token_seconds") is not None)
+    report: Dict[str, Any] = {
+        "calls": len(calls),
+        "attempts": sum(call["attempts"] for call in calls),
+        "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+        "completion_tokens": sum(call["completion_tokens"] for call in calls),
+        "latency_seconds": {
+            "p50": get_percentile(latencies, 50),
+            "p90": get_percentile(latencies, 90),
+            "p99": get_percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0,
+        },
+    }
+    if first_token_latencies:
+        report["time_to_first_token_seconds"] = {
+            "p50": get_percentile(first_token_latencies, 50),
+            "p90": get_percentile(first_token_latencies, 90),
+            "max": first_token_latencies[-1],
+        }
+    return report
@@ -1,3 +1,4 @@
+import hashlib
 import os
 
 
@@ -26,3 +27,18 @@ def get_prompt(filename: str, input_string: str) -> str:
         raise FileNotFoundError(f"The file '{filename}' does not exist in the prompt directory.")
     except IOError as e:
         raise IOError(f"An error occurred while reading the file '{filename}': {e}")
+
+
+def get_prompt_hash(filename: str) -> str:
+    """
+    Return the sha256 hash of a file in the prompt directory, used to key results that depend on the prompt.
+
+    :param filename: The name of the file to hash.
+    :return: The hex digest of the file content.
+    :raises FileNotFoundError: If the file does not exist.
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    file_path = os.path.join(current_dir, "prompt", filename)
+
+    with open(file_path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
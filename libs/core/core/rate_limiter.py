@@ -0,0 +1,49 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+# Token bucket refilled continuously at `per_minute` units per minute, holding at most one minute of units.
+# A bucket can be shared by event loops on different threads, such as the threads of streamed responses.
+class TokenBucket:
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.available = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    async def acquire(self, amount: float) -> None:
+        """Wait until `amount` units are available and take them. Requests larger than the bucket take all of it."""
+        amount = min(amount, self.capacity)
+        while True:
+            # Check and take without awaiting in between, the lock keeps other threads out and coroutines on the
+            # event loop can't interleave here
+            with self.lock:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) / self.rate
+            await asyncio.sleep(wait)
+
+
+# Client side limiter for a service with tokens per minute (TPM) and requests per minute (RPM) quotas
+class RateLimiter:
+    def __init__(self, tokens_per_minute: Optional[float] = None, requests_per_minute: Optional[float] = None) -> None:
+        """
+        :param tokens_per_minute: Token quota, None or 0 for no limit.
+        :param requests_per_minute: Request quota, None or 0 for no limit.
+        """
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait until a request using `tokens` tokens fits in both quotas."""
+        if self.requests:
+            await self.requests.acquire(1)
+        if self.tokens:
+            await self.tokens.acquire(tokens)
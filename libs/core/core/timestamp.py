@@ -0,0 +1,172 @@
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+# Number of lines with a timestamp used to pick the format of a file
+DETECT_SAMPLE_LINES = 20
+
+# Files without any recognized timestamp in this many lines stop looking for one
+DETECT_MAX_LINES = 1000
+
+# Epoch timestamps outside of this range are numbers such as request ids or counters at the start of the line
+EPOCH_MIN_SECONDS = int(datetime(2000, 1, 1, tzinfo=timezone.utc).timestamp())
+EPOCH_MAX_SECONDS = int(datetime(2100, 1, 1, tzinfo=timezone.utc).timestamp())
+
+ISO8601_PATTERN = r"(\d{4}[-/]\d{2}[-/]\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d{1,9})?(?:\s?(?:Z|[+-]\d{2}:?\d{2}))?)"
+ISO8601_PARTS_PATTERN = re.compile(r"(\d{4})[-/](\d{2})[-/](\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:[.,](\d{1,9}))?\s?(Z|[+-]\d{2}:?\d{2})?$")
+
+
+# A timestamp format: a pattern for timestamps and a parser for its match. Anchored formats only
+# look at the start of the line, which fails fast on lines in other formats. The parser also gets a reference time
+# for formats that leave out part of the date, a timestamp is never put more than a day after it.
+class TimestampFormat:
+    __slots__ = ["name", "pattern", "parse_match", "anchored"]
+
+    def __init__(self, name: str, pattern: str, parse_match: Callable[["re.Match[str]", datetime], Optional[datetime]], anchored: bool = True) -> None:
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.parse_match = parse_match
+        self.anchored = anchored
+
+    def parse(self, line: str, reference: datetime) -> Optional[datetime]:
+        match = self.pattern.match(line) if self.anchored else self.pattern.search(line)
+        if match:
+            return self.parse_match(match, reference)
+        return None
+
+
+def parse_fraction(fraction: Optional[str]) -> int:
+    """Convert a fraction of a second with up to nanosecond precision to microseconds."""
+    if not fraction:
+        return 0
+    return int(fraction[:6].ljust(6, "0"))
+
+
+def parse_offset(offset: Optional[str]) -> timezone:
+    if not offset or offset == "Z":
+        return timezone.utc
+    sign = -1 if offset[0] == "-" else 1
+    digits = offset[1:].replace(":", "")
+    return timezone(sign * timedelta(hours=int(digits[:2]), minutes=int(digits[2:])))
+
+
+def parse_iso8601(match: "re.Match[str]", reference: datetime) -> Optional[datetime]:
+    text = match.group(1)
+    try:
+        # Fast path, handles RFC 3339 on Python 3.11+ and the millisecond and microsecond forms everywhere
+        timestamp = datetime.fromisoformat(text)
+    except ValueError:
+        return parse_iso8601_parts(text)
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+def parse_iso8601_parts(text: str) -> Optional[datetime]:
+    """Parse the variants `datetime.fromisoformat` does not handle, such as nanoseconds and slashes."""
+    match = ISO8601_PARTS_PATTERN.match(text)
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    try:
+        return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), parse_fraction(fraction), parse_offset(offset))
+    except ValueError:
+        return None
+
+
+def parse_klog(match: "re.Match[str]", reference: datetime) -> Optional[datetime]:
+    month, day, clock = match.groups()
+    # klog headers have no year. Use the most recent year that does not put the line after the reference time,
+    # Feb 29 can go back to the last leap year.
+    for year in range(reference.year, reference.year - 5, -1):
+        try:
+            timestamp = datetime.fromisoformat(f"{year}-{month}-{day}T{clock}+00:00")
+        except ValueError:
+            continue
+        if timestamp <= reference + timedelta(days=1):
+            return timestamp
+    return None
+
+
+def parse_epoch(match: "re.Match[str]", reference: datetime) -> Optional[datetime]:
+    seconds, fraction = match.groups()
+    if len(seconds) == 13:  # milliseconds
+        seconds, fraction = seconds[:10], seconds[10:] + (fraction or "")
+    epoch_seconds = int(seconds)
+    if not EPOCH_MIN_SECONDS <= epoch_seconds < EPOCH_MAX_SECONDS:
+        return None
+    try:
+        return datetime.fromtimestamp(epoch_seconds, timezone.utc).replace(microsecond=parse_fraction(fraction))
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+# Known formats in the order they are tried while detecting the format of a file.
+# Line prefixed formats come first, formats found anywhere in the line are the fallback.
+TIMESTAMP_FORMATS: List[TimestampFormat] = [
+    # 2024-01-01T00:00:00.000Z, 2024-01-01T00:00:00.123456789+01:00, 2024/01/01 00:00:00 (RFC 3339, kubectl --timestamps, Go log)
+    TimestampFormat("iso8601", r"\[?" + ISO8601_PATTERN, parse_iso8601),
+    # I0101 00:00:00.000000   12345 main.go:10] (klog)
+    TimestampFormat("klog", r"[IWEF](\d{2})(\d{2}) (\d{2}:\d{2}:\d{2}(?:\.\d{6})?)", parse_klog),
+    # 1704067200.123 or 1704067200123 (epoch seconds or milliseconds)
+    TimestampFormat("epoch", r"(\d{10}|\d{13})(?:\.(\d{1,9}))?\b", parse_epoch),
+    # {"ts":1704067200.123,...} (zap JSON)
+    TimestampFormat("epoch_json", r"\"(?:ts|time|timestamp)\":\s*(\d{10}|\d{13})(?:\.(\d{1,9}))?\b", parse_epoch, anchored=False),
+    # {"time":"2024-01-01T00:00:00Z"}, time="2024-01-01T00:00:00Z" (JSON and logfmt)
+    TimestampFormat("iso8601_embedded", ISO8601_PATTERN, parse_iso8601, anchored=False),
+]
+
+
+def parse_timestamp(line: str, reference_time: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Return the timestamp of a log line in any known format, or None. This tries every format,
+    use a `TimestampParser` to parse the lines of a file with the format detected for it.
+
+    :param reference_time: Time the line was logged before at the latest, used for formats without a year. Defaults to now.
+    """
+    reference = reference_time or datetime.now(timezone.utc)
+    for timestamp_format in TIMESTAMP_FORMATS:
+        timestamp = timestamp_format.parse(line, reference)
+        if timestamp:
+            return timestamp
+    return None
+
+
+# Parses the timestamps of the lines of a single file. All formats are tried on the first lines,
+# after that only the format that matched the most lines is used. Use a new parser for every read of a file, the same
+# file name can be in another bundle in another format.
+class TimestampParser:
+    def __init__(self, sample_lines: int = DETECT_SAMPLE_LINES, max_lines: int = DETECT_MAX_LINES, reference_time: Optional[datetime] = None) -> None:
+        """
+        :param sample_lines: Number of lines with a timestamp used to detect the format.
+        :param max_lines: Number of lines after which detection gives up if no timestamp was found.
+        :param reference_time: Time the file was written before at the latest, such as its modification time in the bundle.
+            Used for formats without a year, like klog. Defaults to now, which can move the lines of an older bundle to a later year.
+        """
+        self.reference_time = reference_time or datetime.now(timezone.utc)
+        self.sample_lines = sample_lines
+        self.max_lines = max_lines
+        self.format: Optional[TimestampFormat] = None
+        self.detected = False
+        self.lines = 0
+        self.hits: Dict[str, int] = {}
+
+    def parse(self, line: str) -> Optional[datetime]:
+        if self.detected:
+            return self.format.parse(line, self.reference_time) if self.format else None
+
+        self.lines += 1
+        timestamp = None
+        for timestamp_format in TIMESTAMP_FORMATS:
+            timestamp = timestamp_format.parse(line, self.reference_time)
+            if timestamp:
+                self.hits[timestamp_format.name] = self.hits.get(timestamp_format.name, 0) + 1
+                break
+
+        if sum(self.hits.values()) >= self.sample_lines or self.lines >= self.max_lines:
+            self._select_format()
+        return timestamp
+
+    def _select_format(self) -> None:
+        self.detected = True
+        if self.hits:
+            name = max(self.hits, key=lambda format_name: self.hits[format_name])
+            self.format = next(timestamp_format for timestamp_format in TIMESTAMP_FORMATS if timestamp_format.name == name)
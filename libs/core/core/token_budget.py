@@ -0,0 +1,45 @@
+from typing import Callable, Iterable, List, Optional, TypeVar
+
+from .llm import CHARS_PER_TOKEN, estimate_tokens
+
+T = TypeVar("T")
+
+TRUNCATION_MARKER = " ...[truncated]... "
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """
+    Shorten a text to about `max_tokens` tokens. The start and the end of the text are kept
+    since log messages usually put the error at the start and the details at the end.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    keep = max(max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARKER), 2)
+    head = keep * 2 // 3
+    return text[:head] + TRUNCATION_MARKER + text[len(text) - (keep - head) :]
+
+
+def pack_by_tokens(items: Iterable[T], get_tokens: Callable[[T], int], budget: int, max_items: Optional[int] = None) -> List[List[T]]:
+    """
+    Pack items in order into chunks whose estimated tokens fit in the budget.
+
+    :param items: Items to pack, their order is kept.
+    :param get_tokens: Estimated tokens of an item.
+    :param budget: Maximum tokens of a chunk, an item larger than the budget gets a chunk of its own.
+    :param max_items: Optional maximum number of items in a chunk.
+    :return: The chunks.
+    """
+    chunks: List[List[T]] = []
+    chunk: List[T] = []
+    chunk_tokens = 0
+    for item in items:
+        tokens = get_tokens(item)
+        if chunk and (chunk_tokens + tokens > budget or (max_items and len(chunk) >= max_items)):
+            chunks.append(chunk)
+            chunk = []
+            chunk_tokens = 0
+        chunk.append(item)
+        chunk_tokens += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks